@@ -4,12 +4,13 @@ from pathlib import Path
 from unittest.mock import patch
 
 import pytest
-from httpx import Response
+from httpx import AsyncClient, Response
 from platformdirs import user_config_path
 from pytest_asyncio import fixture as async_fixture
 
 from tofuref.data.bookmarks import Bookmarks
-from tofuref.data.cache import cached_file_path
+from tofuref.data.cache import cached_file_path, close_cache
+from tofuref.data.metadata import _pending as pending_metadata
 
 
 @async_fixture(loop_scope="session", autouse=True)
@@ -58,16 +59,17 @@ def mock_cache_path():
 
     with patch("tofuref.data.cache.user_cache_path", side_effect=mock_user_cache_path):
         yield cache_dir
-    for file in cache_dir.glob("*"):
-        file.open()
-        file.unlink()
-    cache_dir.rmdir()
+    shutil.rmtree(cache_dir)
 
 
 @pytest.fixture
 def clear_mock_cache(mock_cache_path: Path):
+    # Forget the in-memory manifest, it would still list the removed files
+    close_cache()
     for file in mock_cache_path.glob("*"):
-        if file.name != "index.json":
+        if file.is_dir():
+            shutil.rmtree(file)
+        elif file.name != "index.json":
             file.unlink()
 
 
@@ -98,10 +100,30 @@ def mock_http_requests():
 
         return Response(200, content=endpoint_map[url].read_bytes())
 
-    with patch("httpx.AsyncClient.get", side_effect=http_get) as mock_get:
+    send = AsyncClient.send
+
+    async def http_send(client, request, **kwargs):
+        # Streamed requests (documents with a preview) don't go through get
+        if kwargs.get("stream"):
+            response = await http_get(str(request.url))
+            response.request = request
+            return response
+        return await send(client, request, **kwargs)
+
+    with (
+        patch("httpx.AsyncClient.get", side_effect=http_get) as mock_get,
+        patch("httpx.AsyncClient.send", autospec=True, side_effect=http_send),
+    ):
         yield
 
 
+@pytest.fixture(autouse=True)
+def clear_pending_metadata():
+    """Metadata queued (and not flushed) by one test would end up in the cache of another"""
+    yield
+    pending_metadata.clear()
+
+
 @pytest.fixture(scope="session", autouse=True)
 def disable_emoji():
     """Disabling emojis for tests, because they might look different depending on the OS, terminal etc."""
@@ -110,6 +132,14 @@ def disable_emoji():
     os.environ.pop("TOFUREF_THEME_EMOJI")
 
 
+@pytest.fixture(scope="session", autouse=True)
+def disable_speculative_prefetch():
+    """Background fetches on highlight would make snapshots depend on timing"""
+    os.environ["TOFUREF_PREFETCH_DWELL"] = "0"
+    yield
+    os.environ.pop("TOFUREF_PREFETCH_DWELL")
+
+
 @pytest.fixture(scope="session", autouse=True)
 def patch_bookmarks():
     class PatchedBookmarks(Bookmarks):
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import io
+import json
+import tarfile
+from unittest.mock import patch
+
+import pytest
+from anyio import Path as AnyioPath
+from httpx import Headers
+
+from tofuref.config import config
+from tofuref.data.bundle import BundleError, endpoint_patterns, export_bundle, import_bundle
+from tofuref.data.cache import close_cache, get_from_cache, is_cached, load_validators, save_to_cache
+from tofuref.main import main
+
+
+@pytest.fixture
+def cache_dirs(tmp_path, monkeypatch):
+    """Source (files backend) and destination (sqlite backend) caches, the active one is picked with `use`"""
+
+    def use(name: str) -> None:
+        close_cache()
+        (tmp_path / name).mkdir(exist_ok=True)
+        monkeypatch.setattr(config, "cache_backend", "sqlite" if name == "destination" else "files")
+        monkeypatch.setattr("tofuref.data.cache.get_cache_path", lambda: AnyioPath(tmp_path / name))
+
+    yield use
+    close_cache()
+
+
+async def fill_source_cache() -> None:
+    await save_to_cache("index.json", '{"providers": []}', Headers({"ETag": '"abc"'}))
+    for version in ("v6.5.0", "v6.6.0"):
+        await save_to_cache(f"integrations/github/{version}/index.json", "{}")
+        await save_to_cache(f"integrations/github/{version}/resources/membership.md", "# Membership")
+    await save_to_cache("hashicorp/aws/v6.0.0/index.md", "# AWS")
+
+
+def test_endpoint_patterns():
+    assert endpoint_patterns(["integrations/github@v6.6.0"]) == ["integrations/github/v6.6.0/*"]
+
+
+async def test_export_import_bundle(cache_dirs, tmp_path):
+    cache_dirs("source")
+    await fill_source_cache()
+    bundle = tmp_path / "bundle.tar.gz"
+    result = await export_bundle(bundle, ["integrations/github@6.6.0"])
+    assert result.entries == len(["index.json", "v6.6.0/index.json", "v6.6.0/resources/membership.md"])
+    with pytest.raises(BundleError):
+        await export_bundle(bundle, ["hashicorp/google"])
+
+    cache_dirs("destination")
+    await save_to_cache("integrations/github/v6.6.0/index.json", "{}")
+    result = await import_bundle(bundle)
+    assert result.entries == len(["index.json", "v6.6.0/resources/membership.md"])
+    assert result.skipped == ["integrations/github/v6.6.0/index.json"]
+    assert await get_from_cache("integrations/github/v6.6.0/resources/membership.md") == "# Membership"
+    assert await load_validators("index.json") == {"etag": '"abc"'}
+    assert not await is_cached("integrations/github/v6.5.0/index.json")
+
+
+async def test_import_corrupted_bundle(cache_dirs, tmp_path):
+    cache_dirs("source")
+    await fill_source_cache()
+    bundle = tmp_path / "bundle.tar.gz"
+    await export_bundle(bundle)
+
+    corrupted = tmp_path / "corrupted.tar.gz"
+    with tarfile.open(bundle, "r:gz") as source, tarfile.open(corrupted, "w:gz") as target:
+        for member in source:
+            data = source.extractfile(member).read()
+            if member.name == "entries/hashicorp/aws/v6.0.0/index.md":
+                data = b"# Not AWS"
+            target.addfile(member, io.BytesIO(data))
+
+    cache_dirs("destination")
+    with pytest.raises(BundleError, match="corrupted"):
+        await import_bundle(corrupted)
+    # Nothing is imported from a bundle that doesn't match its manifest
+    assert not await is_cached("index.json")
+    (tmp_path / "not-a-bundle.tar.gz").write_bytes(b"nope")
+    with pytest.raises(BundleError):
+        await import_bundle(tmp_path / "not-a-bundle.tar.gz")
+
+
+def write_bundle(path, members: list[tuple[str, bytes]]) -> None:
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+async def test_import_malformed_bundle(cache_dirs, tmp_path):
+    cache_dirs("destination")
+    entry = {"endpoint": "hashicorp/aws/v6.0.0/index.md", "size": 5, "sha256": hashlib.sha256(b"# AWS").hexdigest(), "validators": {}}
+    bundle = tmp_path / "bundle.tar.gz"
+
+    # The checked duplicate would be the last one, but import writes the first one
+    manifest = json.dumps({"format": 1, "entries": [entry]}).encode()
+    write_bundle(
+        bundle,
+        [("entries/hashicorp/aws/v6.0.0/index.md", b"# Evil"), ("entries/hashicorp/aws/v6.0.0/index.md", b"# AWS"), ("bundle.json", manifest)],
+    )
+    with pytest.raises(BundleError, match="more than once"):
+        await import_bundle(bundle)
+    assert not await is_cached("hashicorp/aws/v6.0.0/index.md")
+
+    for malformed in ({"format": 1}, {"format": 1, "entries": [{**entry, "size": "5"}]}, {"format": 1, "entries": [["endpoint"]]}):
+        write_bundle(bundle, [("entries/hashicorp/aws/v6.0.0/index.md", b"# AWS"), ("bundle.json", json.dumps(malformed).encode())])
+        with pytest.raises(BundleError, match="manifest"):
+            await import_bundle(bundle)
+
+
+def test_bundle_commands(cache_dirs, tmp_path, capsys):
+    cache_dirs("source")
+    asyncio.run(fill_source_cache())
+    close_cache()
+    bundle = tmp_path / "bundle.tar.gz"
+    with patch("sys.argv", ["tofuref", "cache", "export", str(bundle), "hashicorp/aws"]), pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 0
+    assert "Exported 2 entries" in capsys.readouterr().out
+
+    cache_dirs("destination")
+    with patch("sys.argv", ["tofuref", "cache", "import", str(bundle)]), pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 0
+    assert "Imported 2 entries" in capsys.readouterr().out
+
+
+async def test_import_bundle_reserved_names(cache_dirs, tmp_path):
+    cache_dirs("source")
+    database = tmp_path / "source" / "cache.sqlite3"
+    database.write_bytes(b"database")
+    bundle = tmp_path / "bundle.tar.gz"
+    for endpoint in ("cache.sqlite3", "cache.sqlite3-wal", "index.json.validators", "a/b/v1/index.json.1.tmp", "a/b/v1/resources/x.txt"):
+        entry = {"endpoint": endpoint, "size": 4, "sha256": hashlib.sha256(b"junk").hexdigest(), "validators": {}}
+        write_bundle(bundle, [(f"entries/{endpoint}", b"junk"), ("bundle.json", json.dumps({"format": 1, "entries": [entry]}).encode())])
+        with pytest.raises(BundleError, match="not a registry endpoint"):
+            await import_bundle(bundle)
+    assert database.read_bytes() == b"database"
@@ -1,6 +1,345 @@
-from tofuref.data.cache import get_from_cache, save_to_cache
+import gzip
+import os
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+from anyio import Path as AnyioPath
+from httpx import Headers, Response
+
+from tofuref.config import config
+from tofuref.data.cache import (
+    BLOBS_DIRNAME,
+    MANIFEST_FILENAME,
+    SQLITE_FILENAME,
+    CacheEntry,
+    CacheKey,
+    cached_file_path,
+    clear_from_cache,
+    clear_many_from_cache,
+    close_cache,
+    get_cache_usage,
+    get_cached_providers,
+    get_cached_resources,
+    get_from_cache,
+    get_revalidation_headers,
+    is_cached,
+    load_validators,
+    parse_endpoint,
+    parse_validators,
+    save_to_cache,
+    total_size,
+    usage_by_version,
+    verify_cache,
+)
+from tofuref.data.eviction import evict, select_for_eviction
+from tofuref.data.helpers import get_registry_api
+from tofuref.data.stats import STATS_FILENAME, CacheStats, load_stats, stats
+from tofuref.main import main
 
 
 async def test_cache_the_same():
     await save_to_cache("test", "test")
     assert await get_from_cache("test") == "test"
+
+
+async def test_expired_index_revalidated(mock_cache_path):
+    await save_to_cache("index.json", '{"providers": []}', Headers({"ETag": '"abc"', "Cache-Control": "public, max-age=60"}))
+    cached_file = await cached_file_path("index.json")
+    os.utime(cached_file, (0, 0))
+    assert await get_from_cache("index.json") is None
+    assert await get_revalidation_headers("index.json") == {"If-None-Match": '"abc"'}
+
+    async def not_modified(url, **kwargs):
+        assert kwargs["headers"] == {"If-None-Match": '"abc"'}
+        return Response(304, headers={"Cache-Control": "max-age=120"})
+
+    with patch("httpx.AsyncClient.get", side_effect=not_modified):
+        assert await get_registry_api("index.json") == {"providers": []}
+    assert await get_from_cache("index.json") == '{"providers": []}'
+    assert await load_validators("index.json") == {"etag": '"abc"', "max_age": 120}
+    await clear_from_cache("index.json*")
+
+
+def test_parse_validators():
+    headers = {"etag": 'W/"1"', "last-modified": "Wed, 21 Oct 2015 07:28:00 GMT", "cache-control": "max-age=3600, must-revalidate"}
+    assert parse_validators(headers) == {"etag": 'W/"1"', "last_modified": "Wed, 21 Oct 2015 07:28:00 GMT", "max_age": 3600}
+    assert parse_validators({}) == {}
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "auto"])
+async def test_cache_compression(mock_cache_path, compression):
+    with patch.object(config, "cache_compression", compression):
+        await save_to_cache("compressed.md", "# Title\n" * 100)
+    cached_file = await cached_file_path("compressed.md")
+    if compression != "none":
+        assert len(await cached_file.read_bytes()) < len("# Title\n" * 100)
+    # Reading doesn't depend on the configured format
+    assert await get_from_cache("compressed.md") == "# Title\n" * 100
+    await cached_file.unlink()
+
+
+async def test_cache_reads_uncompressed_entries(mock_cache_path):
+    cached_file = await cached_file_path("legacy.md")
+    await cached_file.write_text("legacy")
+    assert await get_from_cache("legacy.md") == "legacy"
+    await cached_file.unlink()
+
+
+@pytest.fixture
+def sqlite_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "cache_backend", "sqlite")
+    monkeypatch.setattr("tofuref.data.cache.get_cache_path", lambda: AnyioPath(tmp_path))
+    yield tmp_path
+    close_cache()
+
+
+def test_parse_endpoint():
+    assert parse_endpoint("index.json") == CacheKey(None, None, None, "index.json")
+    assert parse_endpoint("hashicorp/aws/v6.0.0/index.json") == CacheKey("hashicorp", "aws", "v6.0.0", "index")
+    assert parse_endpoint("hashicorp/aws/v6.0.0/index.md") == CacheKey("hashicorp", "aws", "v6.0.0", "overview")
+    assert parse_endpoint("hashicorp/aws/v6.0.0/datasources/s3_bucket.md") == CacheKey("hashicorp", "aws", "v6.0.0", "datasources", "s3_bucket")
+
+
+async def test_sqlite_cache(sqlite_cache):
+    await save_to_cache("index.json", '{"providers": []}', Headers({"ETag": '"abc"'}))
+    await save_to_cache("integrations/github/v6.6.0/index.json", "{}")
+    await save_to_cache("integrations/github/v6.6.0/resources/membership.md", "# Membership")
+    await save_to_cache("integrations/github/v6.5.0/index.json", "{}")
+
+    assert (sqlite_cache / SQLITE_FILENAME).exists()
+    assert await get_from_cache("integrations/github/v6.6.0/resources/membership.md") == "# Membership"
+    assert await load_validators("index.json") == {"etag": '"abc"'}
+    assert await get_cached_providers() == ["integrations/github"]
+    assert await get_cached_resources("integrations", "github", "v6.6.0") == ["resources/membership"]
+
+    await clear_from_cache("integrations/github/*")
+    assert not await is_cached("integrations/github/v6.5.0/index.json")
+    assert await get_cached_providers() == []
+    assert await is_cached("index.json")
+
+
+@pytest.fixture
+def files_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "cache_backend", "files")
+    monkeypatch.setattr("tofuref.data.cache.user_cache_path", lambda *args, **kwargs: tmp_path)
+    yield tmp_path
+    close_cache()
+
+
+async def test_files_cache_manifest(files_cache):
+    for version in ("v6.5.0", "v6.6.0"):
+        await save_to_cache(f"integrations/github/{version}/index.json", "{}")
+        await save_to_cache(f"integrations/github/{version}/resources/membership.md", "# Membership")
+    assert await get_cached_providers() == ["integrations/github", "integrations/github"]
+    assert await get_cached_resources("integrations", "github", "v6.6.0") == ["resources/membership"]
+    close_cache()
+    assert (files_cache / MANIFEST_FILENAME).exists()
+
+    # Persisted manifest is used as is, without scanning the directory
+    with patch("os.scandir", side_effect=AssertionError("cache directory scanned")):
+        assert await get_cached_resources("integrations", "github", "v6.5.0") == ["resources/membership"]
+        await clear_from_cache("integrations/github/*")
+        assert await get_cached_providers() == []
+    assert [f.name for f in files_cache.iterdir() if f.name not in (MANIFEST_FILENAME, STATS_FILENAME, BLOBS_DIRNAME)] == []
+    close_cache()
+
+    # Files added behind tofuref's back invalidate the persisted manifest
+    (files_cache / "integrations_github_v6.6.0_index.json").write_text("{}")
+    assert await get_cached_providers() == ["integrations/github"]
+
+
+def test_select_for_eviction(monkeypatch, patch_bookmarks):
+    monkeypatch.setattr(config, "cache_max_size_mb", 1)
+    monkeypatch.setattr(config, "cache_keep_versions", 2)
+    bookmarks = patch_bookmarks()
+    bookmarks.saved["resources"] = ["github_resource_repository"]
+    mb = 1024 * 1024
+    entries = [
+        CacheEntry("index.json", 10, 0),
+        CacheEntry("integrations/github/v6.4.0/index.json", 10, 5),
+        CacheEntry("integrations/github/v6.5.0/index.json", 10, 1),
+        CacheEntry("integrations/github/v6.6.0/resources/membership.md", 2 * mb, 2),
+        CacheEntry("integrations/github/v6.6.0/resources/repository.md", 10, 0),
+        CacheEntry("hashicorp/aws/v6.0.0/index.md", 10, 3),
+    ]
+    selected = {e.endpoint for e in select_for_eviction(entries, bookmarks)}
+    # Oldest version goes regardless of use, then least recently used until it fits, except index and bookmarks
+    assert selected == {
+        "integrations/github/v6.4.0/index.json",
+        "integrations/github/v6.5.0/index.json",
+        "integrations/github/v6.6.0/resources/membership.md",
+    }
+
+    # A shared body counts once, evicting one of its entries frees nothing
+    monkeypatch.setattr(config, "cache_keep_versions", 0)
+    entries = [
+        CacheEntry(f"integrations/github/{version}/resources/membership.md", mb, last_used, "membership")
+        for last_used, version in enumerate(("v6.5.0", "v6.6.0"))
+    ]
+    assert select_for_eviction(entries, bookmarks) == []
+    entries.append(CacheEntry("hashicorp/aws/v6.0.0/index.md", 10, 3))
+    assert [e.endpoint for e in select_for_eviction(entries, bookmarks)] == [e.endpoint for e in entries[:2]]
+
+
+async def test_evict(files_cache, monkeypatch, patch_bookmarks):
+    monkeypatch.setattr(config, "cache_keep_versions", 1)
+    for version in ("v6.5.0", "v6.6.0"):
+        await save_to_cache(f"integrations/github/{version}/index.json", "{}")
+        await save_to_cache(f"integrations/github/{version}/resources/actions_environment_secret.md", "# Secret")
+    result = await evict(patch_bookmarks())
+    assert result.evicted == len(["index.json", "actions_environment_secret.md"])
+    assert await get_cached_resources("integrations", "github", "v6.5.0") == []
+    assert await get_cached_resources("integrations", "github", "v6.6.0") == ["resources/actions_environment_secret"]
+
+
+def test_cache_stats_counters():
+    session = CacheStats(hits=3, misses=1)
+    session.record_latency(0.02)
+    session.record_latency(0.3)
+    session.record_latency(10)
+    assert session.hit_ratio == 0.75  # noqa: PLR2004
+    assert session.latency_histogram() == {"<50ms": 1, "<100ms": 0, "<250ms": 0, "<500ms": 1, "<1000ms": 0, "<2500ms": 0, ">=2500ms": 1}
+    accumulated = CacheStats(hits=1)
+    accumulated.merge(session)
+    assert accumulated.hits == 4  # noqa: PLR2004
+    assert accumulated.fetch_latency_ms == session.fetch_latency_ms
+    session.reset()
+    assert session == CacheStats()
+
+
+async def test_cache_stats_persisted(files_cache):
+    stats.reset()
+    await get_registry_api("integrations/github/v6.6.0/index.md", json=False)
+    await get_registry_api("integrations/github/v6.6.0/index.md", json=False)
+    assert (stats.hits, stats.misses) == (1, 1)
+    assert stats.bytes_written > 0
+    assert stats.bytes_read > 0
+    assert sum(stats.fetch_latency_ms) == 1
+    close_cache()
+    assert stats == CacheStats()
+    assert load_stats(files_cache).misses == 1
+
+    # Saving stats doesn't make the manifest look outdated
+    with patch("os.scandir", side_effect=AssertionError("cache directory scanned")):
+        assert await get_cached_resources("integrations", "github", "v6.6.0") == []
+
+
+async def test_verify_cache(files_cache):
+    await save_to_cache("integrations/github/v6.6.0/index.json", "{}")
+    await save_to_cache("integrations/github/v6.6.0/resources/membership.md", "# Membership")
+    await save_to_cache("integrations/github/v6.6.0/resources/repository.md", "# Repository")
+    await save_to_cache("integrations/github/v6.5.0/index.json", "{")
+    (files_cache / "integrations_github_v6.6.0_resources_membership.md").write_bytes(b"")
+    (files_cache / "integrations_github_v6.6.0_resources_repository.md").write_bytes(gzip.compress(b"# Repository")[:-4])
+    problems = {p.endpoint: p.problem for p in await verify_cache()}
+    assert problems.keys() == {
+        "integrations/github/v6.6.0/resources/membership.md",
+        "integrations/github/v6.6.0/resources/repository.md",
+        "integrations/github/v6.5.0/index.json",
+    }
+    assert problems["integrations/github/v6.5.0/index.json"] == "invalid JSON"
+
+    entries = [
+        CacheEntry("index.json", 100, 0),
+        CacheEntry("a/b/v1/index.json", 10, 0),
+        CacheEntry("a/b/v1/index.md", 5, 0, "overview"),
+        CacheEntry("a/b/v2/index.md", 5, 0, "overview"),
+    ]
+    assert usage_by_version(entries) == {("index.json", ""): 100, ("a/b", "v1"): 15, ("a/b", "v2"): 5}
+    assert total_size(entries) == 100 + 10 + 5
+
+
+def test_cache_verify_command(files_cache, capsys):
+    (files_cache / "integrations_github_v6.6.0_index.json").write_bytes(b"")
+    with patch("sys.argv", ["tofuref", "cache", "verify"]), pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 1
+    assert "integrations/github/v6.6.0/index.json: empty body" in capsys.readouterr().err
+
+    with patch("sys.argv", ["tofuref", "cache", "verify", "--fix"]), pytest.raises(SystemExit) as exit_info:
+        main()
+    assert exit_info.value.code == 0
+    assert not (files_cache / "integrations_github_v6.6.0_index.json").exists()
+
+
+async def test_files_cache_deduplication(files_cache):
+    for version in ("v6.5.0", "v6.6.0"):
+        await save_to_cache(f"integrations/github/{version}/resources/membership.md", "# Membership")
+        await save_to_cache(f"integrations/github/{version}/resources/repository.md", f"# Repository {version}")
+    membership = [files_cache / f"integrations_github_{version}_resources_membership.md" for version in ("v6.5.0", "v6.6.0")]
+    assert membership[0].stat().st_ino == membership[1].stat().st_ino
+    assert len(list((files_cache / BLOBS_DIRNAME).iterdir())) == len(["membership", "repository v6.5.0", "repository v6.6.0"])
+    blob_sizes = {blob.name: blob.stat().st_size for blob in (files_cache / BLOBS_DIRNAME).iterdir()}
+    assert total_size(await get_cache_usage()) == sum(blob_sizes.values())
+
+    # Only blobs nothing links to anymore are dropped, and only those count as freed
+    repository = (files_cache / "integrations_github_v6.5.0_resources_repository.md").stat().st_size
+    assert await clear_from_cache("integrations/github/v6.5.0/*") == repository
+    assert len(list((files_cache / BLOBS_DIRNAME).iterdir())) == len(["membership", "repository v6.6.0"])
+    assert await get_from_cache("integrations/github/v6.6.0/resources/membership.md") == "# Membership"
+    await clear_from_cache("integrations/github/*")
+    assert list((files_cache / BLOBS_DIRNAME).iterdir()) == []
+
+
+async def test_files_cache_delete_many_collects_once(files_cache):
+    endpoints = [f"integrations/github/v6.{minor}.0/resources/membership.md" for minor in range(5)]
+    for endpoint in endpoints:
+        await save_to_cache(endpoint, "# Membership")
+    with patch("tofuref.data.cache.FilesCacheBackend._collect_garbage", autospec=True) as collect_garbage:
+        await clear_many_from_cache(endpoints)
+    collect_garbage.assert_called_once()
+
+
+async def test_sqlite_cache_deduplication(sqlite_cache):
+    for version in ("v6.5.0", "v6.6.0"):
+        await save_to_cache(f"integrations/github/{version}/resources/membership.md", "# Membership")
+        await save_to_cache(f"integrations/github/{version}/index.json", "{}")
+    with sqlite3.connect(sqlite_cache / SQLITE_FILENAME) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM blobs").fetchone() == (1,)
+    usage = await get_cache_usage()
+    membership, index = (next(e.size for e in usage if e.endpoint.endswith(suffix)) for suffix in ("membership.md", "index.json"))
+    assert total_size(usage) == membership + 2 * index
+
+    # Shared body is freed with its last entry
+    assert await clear_from_cache("integrations/github/v6.5.0/*") == index
+    assert await get_from_cache("integrations/github/v6.6.0/resources/membership.md") == "# Membership"
+    assert await clear_many_from_cache(["integrations/github/v6.6.0/index.json", "integrations/github/*"]) == membership + index
+    with sqlite3.connect(sqlite_cache / SQLITE_FILENAME) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM blobs").fetchone() == (0,)
+
+
+async def test_sqlite_cache_migration(sqlite_cache):
+    with sqlite3.connect(sqlite_cache / SQLITE_FILENAME) as connection:
+        connection.execute(
+            "CREATE TABLE entries (endpoint TEXT PRIMARY KEY, organization TEXT, name TEXT, version TEXT, kind TEXT NOT NULL, resource TEXT, "
+            "fetched_at REAL NOT NULL, etag TEXT, last_modified TEXT, max_age INTEGER, size INTEGER NOT NULL, last_used REAL NOT NULL, "
+            "body BLOB NOT NULL)"
+        )
+        connection.execute(
+            "INSERT INTO entries VALUES ('old.md', NULL, NULL, NULL, 'old.md', NULL, 0, NULL, NULL, NULL, 3, 0, CAST('old' AS BLOB))"
+        )
+    connection.close()
+    assert await get_from_cache("old.md") == "old"
+    await save_to_cache("integrations/github/v6.6.0/resources/membership.md", "# Membership")
+    assert await get_from_cache("integrations/github/v6.6.0/resources/membership.md") == "# Membership"
+
+
+async def test_sqlite_cache_migration_without_last_used(sqlite_cache):
+    with sqlite3.connect(sqlite_cache / SQLITE_FILENAME) as connection:
+        connection.execute(
+            "CREATE TABLE entries (endpoint TEXT PRIMARY KEY, organization TEXT, name TEXT, version TEXT, kind TEXT NOT NULL, resource TEXT, "
+            "fetched_at REAL NOT NULL, etag TEXT, last_modified TEXT, max_age INTEGER, size INTEGER NOT NULL, body BLOB NOT NULL)"
+        )
+        connection.execute(
+            "INSERT INTO entries VALUES ('old.md', NULL, NULL, NULL, 'old.md', NULL, 7, NULL, NULL, NULL, 3, CAST('old' AS BLOB))"
+        )
+    connection.close()
+    assert await get_from_cache("old.md") == "old"
+    await save_to_cache("integrations/github/v6.6.0/index.json", "{}")
+    assert await get_from_cache("integrations/github/v6.6.0/index.json") == "{}"
+    await save_to_cache("integrations/github/v6.6.0/resources/membership.md", "# Membership")
+    assert await get_from_cache("integrations/github/v6.6.0/resources/membership.md") == "# Membership"
+    usage = {entry.endpoint: entry for entry in await get_cache_usage()}
+    assert usage.keys() == {"old.md", "integrations/github/v6.6.0/index.json", "integrations/github/v6.6.0/resources/membership.md"}
+    assert usage["integrations/github/v6.6.0/index.json"].last_used > 0
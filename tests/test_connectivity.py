@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from tofuref.config import config
+from tofuref.data.connectivity import Connectivity, connectivity
+from tofuref.data.helpers import get_registry_api
+
+
+@pytest.fixture
+def breaker():
+    yield connectivity
+    connectivity.reset()
+
+
+async def test_breaker_opens_after_consecutive_failures():
+    breaker = Connectivity()
+    changes = []
+    breaker.add_listener(changes.append)
+    for _ in range(config.offline_after_failures - 1):
+        breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.offline
+    for _ in range(config.offline_after_failures):
+        breaker.record_failure()
+    assert breaker.offline
+    breaker.record_success()
+    assert not breaker.offline
+    assert changes == [True, False]
+    breaker.reset()
+
+
+async def test_offline_cache_miss_skips_network(clear_mock_cache, breaker):
+    async def unreachable(*args, **kwargs):
+        raise httpx.ConnectError("no route to host")
+
+    with patch("httpx.AsyncClient.head", side_effect=unreachable):
+        assert not await breaker.probe()
+    assert breaker.offline
+
+    with patch("httpx.AsyncClient.get") as mock_get:
+        assert await get_registry_api("integrations/github/v6.6.0/resources/membership.md", json=False) == ""
+    mock_get.assert_not_called()
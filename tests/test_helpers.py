@@ -0,0 +1,133 @@
+import asyncio
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from tofuref.data.cache import get_from_cache
+from tofuref.data.connectivity import close_http_client, get_http_client
+from tofuref.data.decoding import decode_json, schema_for
+from tofuref.data.helpers import FetchStatus, _in_flight, _not_found, document_preview, fetch_registry_api, get_registry_api
+from tofuref.data.providers import listed_providers
+from tofuref.data.stats import stats
+
+
+async def test_http_client_is_shared():
+    client = get_http_client()
+    assert get_http_client() is client
+    await close_http_client()
+    assert client.is_closed
+    assert get_http_client() is not client
+    await close_http_client()
+
+
+async def test_concurrent_requests_share_one_fetch(clear_mock_cache, mock_http_requests):
+    endpoint = "integrations/github/v6.6.0/resources/membership.md"
+    with patch("httpx.AsyncClient.get", wraps=httpx.AsyncClient.get) as mock_get:
+        results = await asyncio.gather(*(get_registry_api(endpoint, json=False) for _ in range(5)))
+    assert mock_get.call_count == 1
+    assert len(set(results)) == 1
+    assert await get_from_cache(endpoint) == results[0]
+
+
+async def test_abandoned_request_is_cancelled(clear_mock_cache):
+    started = asyncio.Event()
+
+    async def slow_get(url, **kwargs):
+        started.set()
+        await asyncio.sleep(10)
+
+    endpoint = "integrations/github/v6.6.0/resources/repository.md"
+    with patch("httpx.AsyncClient.get", side_effect=slow_get):
+        waiter = asyncio.create_task(get_registry_api(endpoint, json=False))
+        await started.wait()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.sleep(0)
+    assert await get_from_cache(endpoint) is None
+    assert endpoint not in _in_flight
+
+
+async def test_not_found_is_remembered(clear_mock_cache):
+    endpoint = "integrations/github/v6.6.0/resources/missing.md"
+    stats.reset()
+    _not_found["integrations/github/v6.6.0/resources/gone.md"] = 0
+    with patch("httpx.AsyncClient.get", return_value=httpx.Response(404, text="Not found")) as mock_get:
+        for _ in range(3):
+            response = await fetch_registry_api(endpoint, json=False)
+            assert response.status == FetchStatus.NOT_FOUND
+            assert not response.available
+        assert mock_get.call_count == 1
+        assert await get_from_cache(endpoint) is None
+        # Remembered answers aren't cache misses
+        assert (stats.misses, stats.not_found, stats.not_found_remembered) == (1, 1, 2)
+        # Expired entries are dropped when a new one is remembered
+        assert list(_not_found) == [endpoint]
+
+        # Asked again once it expires
+        _not_found[endpoint] = 0
+        assert await get_registry_api(endpoint, json=False) == ""
+        assert mock_get.call_count == len(["first", "expired"])
+    _not_found.clear()
+
+
+async def test_server_error_is_not_cached(clear_mock_cache):
+    endpoint = "integrations/github/v6.6.0/resources/membership.md"
+    with patch("httpx.AsyncClient.get", return_value=httpx.Response(503, text="Service Unavailable")):
+        response = await fetch_registry_api(endpoint, json=False)
+    assert response.status == FetchStatus.UNAVAILABLE
+    assert response.http_status == httpx.codes.SERVICE_UNAVAILABLE
+    assert await get_from_cache(endpoint, allow_expired=True) is None
+
+    response = await fetch_registry_api(endpoint, json=False)
+    assert response.status == FetchStatus.OK
+    assert response.content.startswith("---")
+
+
+async def test_streamed_document_preview(clear_mock_cache):
+    endpoint = "hashicorp/aws/v6.0.0-beta1/index.md"
+    document = (Path(__file__).parent / "responses" / "aws_600beta1_index.md").read_bytes()
+    sent = []
+    previews = []
+
+    async def chunks():
+        for start in range(0, len(document), 1024):
+            sent.append(start)
+            yield document[start : start + 1024]
+
+    async def send(request, **kwargs):
+        return httpx.Response(200, content=chunks(), request=request)
+
+    async def on_preview(beginning):
+        previews.append((beginning, len(sent)))
+
+    with patch("httpx.AsyncClient.send", side_effect=send):
+        content = await get_registry_api(endpoint, json=False, on_preview=document_preview(on_preview))
+    assert content == document.decode()
+    assert await get_from_cache(endpoint) == content
+    assert len(previews) == 1
+    beginning, chunks_sent = previews[0]
+    # Without frontmatter, long before the whole document arrived
+    assert beginning.startswith("\n# AWS Provider")
+    assert beginning in content
+    assert chunks_sent < len(sent)
+
+
+def test_decode_json():
+    content = (Path(__file__).parent.parent / "tofuref" / "fallback" / "providers.json").read_bytes()
+    with patch("tofuref.data.decoding.msgspec", None), patch("tofuref.data.decoding.orjson", None):
+        assert decode_json(content, schema_for("index.json")) == json.loads(content)
+    # Whichever decoder is available, tofuref sees the same providers
+    providers = [(p.display_name, p.popularity, p.versions) for p in listed_providers(decode_json(content, schema_for("index.json")))]
+    assert providers == [(p.display_name, p.popularity, p.versions) for p in listed_providers(json.loads(content))]
+
+
+def test_decode_json_typed():
+    pytest.importorskip("msgspec")
+    content = (Path(__file__).parent / "responses" / "github_660_index.json").read_bytes()
+    decoded = decode_json(content, schema_for("integrations/github/v6.6.0/index.json"))
+    # Only fields tofuref uses are kept
+    assert set(decoded) == {"docs"}
+    assert set(decoded["docs"]["resources"][0]) == {"name"}
@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from tofuref.data.cache import get_from_cache
+from tofuref.data.prefetch import PrefetchError, resolve_targets, version_endpoints
+from tofuref.main import TofuRefApp, main
+
+RESPONSES = Path(__file__).parent / "responses"
+
+
+async def test_resolve_targets():
+    targets = await resolve_targets(["integrations/github@6.5.0"], top=2, versions=2)
+    resolved = {t.provider.display_name: t.versions for t in targets}
+    assert resolved["integrations/github"] == ["v6.5.0"]
+    assert resolved["hashicorp/aws"] == ["v6.0.0-beta1", "v5.98.0"]
+    assert set(resolved) == {"integrations/github", "hashicorp/aws", "hashicorp/azurerm"}
+
+
+async def test_resolve_targets_unknown_version():
+    with pytest.raises(PrefetchError):
+        await resolve_targets(["integrations/github@v0.0.1"])
+
+
+async def test_version_endpoints():
+    targets = await resolve_targets(["integrations/github"])
+    index = json.loads((RESPONSES / "github_660_index.json").read_text())
+    endpoints = version_endpoints(targets[0].provider, "v6.6.0", index)
+    assert endpoints[0] == "integrations/github/v6.6.0/index.md"
+    assert "integrations/github/v6.6.0/resources/membership.md" in endpoints
+    assert "integrations/github/v6.6.0/datasources/actions_environment_secrets.md" in endpoints
+    assert len(endpoints) == 1 + 71 + 62
+
+
+def test_prefetch_command(clear_mock_cache, capsys):
+    docs = ["integrations/github/v6.6.0/index.md", "integrations/github/v6.6.0/resources/membership.md"]
+    with (
+        patch("sys.argv", ["tofuref", "prefetch", "integrations/github@v6.6.0"]),
+        patch("tofuref.data.prefetch.version_endpoints", return_value=docs),
+        pytest.raises(SystemExit) as exit_info,
+    ):
+        main()
+    assert exit_info.value.code == 0
+    assert "Downloaded 2, already cached 0, failed 0" in capsys.readouterr().out
+    assert all((Path("__tests_cache__") / d.replace("/", "_")).exists() for d in docs)
+
+
+def test_prefetch_command_unknown_provider(clear_mock_cache, capsys):
+    with (
+        patch("sys.argv", ["tofuref", "prefetch", "integrations/gitlab"]),
+        patch("tofuref.main.close_http_client") as close_http_client,
+        patch("tofuref.main.close_cache") as close_cache,
+        pytest.raises(SystemExit) as exit_info,
+    ):
+        main()
+    assert exit_info.value.code == 1
+    assert "Provider integrations/gitlab not found" in capsys.readouterr().err
+    # Resolving targets already used the client and the cache
+    close_http_client.assert_awaited_once()
+    close_cache.assert_called_once()
+
+
+async def test_speculative_prefetch_on_highlight(clear_mock_cache, monkeypatch):
+    monkeypatch.setenv("TOFUREF_PREFETCH_DWELL", "0.01")
+    app = TofuRefApp()
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        github = app.providers["integrations/github"]
+        app.navigation_providers.populate([github])
+        app.navigation_providers.highlighted = 0
+        await pilot.pause(0.1)
+        await app.workers.wait_for_complete()
+        assert github._overview is not None
+        assert await get_from_cache(github.resources_endpoint) is not None
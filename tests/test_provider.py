@@ -1,6 +1,16 @@
+import asyncio
 import json
+import os
+import sys
+from unittest.mock import patch
 
-from tofuref.data.providers import Provider
+from httpx import Headers, Response
+
+from tofuref.data.cache import clear_from_cache, close_cache, get_from_cache, save_to_cache
+from tofuref.data.metadata import flush_metadata, load_metadata
+from tofuref.data.providers import Provider, diff_resources, listed_providers
+from tofuref.data.snapshot import load_provider_snapshot, save_provider_snapshot
+from tofuref.main import TofuRefApp
 from tofuref.widgets.providers_option_list import ProvidersOptionList
 
 PROVIDER_JSON = json.loads("""{
@@ -41,6 +51,15 @@ PROVIDER_JSON = json.loads("""{
 """)
 
 
+def test_provider_versions_decoded_lazily():
+    provider = Provider.from_json(PROVIDER_JSON)
+    assert provider.listed
+    assert provider._versions is None
+    assert provider.versions == ("v1.9.1", "v1.8.1", "v1.7.0")
+    assert provider._raw_versions is None
+    assert provider.name is sys.intern("rabbitmq")
+
+
 def test_provider_use():
     provider = Provider.from_json(PROVIDER_JSON)
     assert (
@@ -55,3 +74,149 @@ def test_provider_use():
 def test_provider_fallback_exists():
     p = ProvidersOptionList()
     assert p.fallback_providers_file.exists()
+
+
+async def test_expired_index_refreshed_in_background(mock_cache_path):
+    index_file = mock_cache_path / "index.json"
+    index = json.loads(index_file.read_text())
+    os.utime(index_file, (0, 0))
+    # One provider got delisted, another one was added
+    delisted = next(p for p in index["providers"] if (p["addr"]["namespace"], p["addr"]["name"]) == ("hashicorp", "aws"))
+    refreshed = {"providers": [*(p for p in index["providers"] if p is not delisted), PROVIDER_JSON]}
+    registry_responds = asyncio.Event()
+
+    async def registry_get(url, **kwargs):
+        assert url.endswith("/index.json")
+        await registry_responds.wait()
+        return Response(200, json=refreshed)
+
+    app = TofuRefApp()
+    with patch("httpx.AsyncClient.get", side_effect=registry_get):
+        async with app.run_test() as pilot:
+            await pilot.pause()
+            # First screen is rendered from the expired index, without waiting for the registry
+            assert app.navigation_providers.display
+            assert "0username/rabbitmq" not in app.providers
+            assert "hashicorp/aws" in app.providers
+            app.navigation_providers.highlighted = 2
+            highlighted = app.navigation_providers.highlighted_option.prompt
+
+            registry_responds.set()
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            assert "0username/rabbitmq" in app.providers
+            assert "hashicorp/aws" not in app.providers
+            assert "hashicorp/aws" not in app.provider_index.keys
+            assert app.navigation_providers.option_count == len(app.providers)
+            assert app.navigation_providers.highlighted_option.prompt is highlighted
+    assert json.loads(await get_from_cache("index.json")) == refreshed
+
+
+async def test_guide_titles_from_metadata(mock_cache_path, patch_bookmarks):
+    guide = "---\npage_title: Getting Started\nsubcategory: Guides\n---\n# Getting started"
+    docs = {"index": [], "resources": [], "datasources": [], "functions": [], "guides": [{"name": "getting_started"}]}
+
+    async def registry_get(url, **kwargs):
+        if url.endswith("/index.json"):
+            return Response(200, json={"docs": docs})
+        return Response(200, text=guide)
+
+    with patch("httpx.AsyncClient.get", side_effect=registry_get):
+        provider = Provider.from_json(PROVIDER_JSON)
+        await provider.reload_resources(patch_bookmarks())
+        await provider.resources[0].content()
+
+    metadata = await load_metadata("0username", "rabbitmq", "v1.9.1")
+    assert metadata == {"guides/getting_started": {"title": "Getting Started", "subcategory": "Guides"}}
+    # The sidecar is written once, when flushed
+    assert await get_from_cache("0username/rabbitmq/v1.9.1/metadata.json") is None
+    await flush_metadata()
+    assert json.loads(await get_from_cache("0username/rabbitmq/v1.9.1/metadata.json")) == metadata
+    provider = Provider.from_json(PROVIDER_JSON)
+    # Listing doesn't read cached documents
+    with patch("tofuref.data.resources.Resource.content", side_effect=AssertionError("document loaded")):
+        await provider.reload_resources(patch_bookmarks())
+    assert provider.resources[0].display_name == "Getting Started"
+    await clear_from_cache("0username/rabbitmq/*")
+
+
+async def test_provider_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr("tofuref.data.cache.user_cache_path", lambda *args, **kwargs: tmp_path)
+    index = {"providers": [PROVIDER_JSON, {**PROVIDER_JSON, "is_blocked": True}]}
+    await save_to_cache("index.json", json.dumps(index), Headers({"ETag": '"1"'}))
+    await save_provider_snapshot(listed_providers(index))
+
+    snapshot = await load_provider_snapshot()
+    assert [(p.display_name, p.versions) for p in snapshot] == [("0username/rabbitmq", ("v1.9.1", "v1.8.1", "v1.7.0"))]
+
+    # Any change of the cached index makes the snapshot stale
+    await save_to_cache("index.json", json.dumps(index), Headers({"ETag": '"2"'}))
+    assert await load_provider_snapshot() is None
+    close_cache()
+
+
+async def test_resources_kept_per_version(mock_cache_path, patch_bookmarks):
+    github = Provider(organization="integrations", name="github", description="", fork_count=0, blocked=False, popularity=0)
+    github.versions = ("v6.6.0", "v6.5.0")
+    bookmarks = patch_bookmarks()
+    await github.load_resources(bookmarks)
+    latest = github.resources
+    github.active_version = "v6.5.0"
+    await github.load_resources(bookmarks)
+    assert github.resources is not latest
+
+    bookmarks.saved["resources"] = [latest[-1].identifying_name]
+    with patch("tofuref.data.providers.get_registry_api", side_effect=AssertionError("index loaded again")):
+        github.active_version = "v6.6.0"
+        await github.load_resources(bookmarks)
+    assert github.resources is latest
+    assert github.resources[0].bookmarked
+
+    github.invalidate_resources()
+    assert github.resources == []
+    github.active_version = "v6.5.0"
+    assert github.resources == []
+    await clear_from_cache("integrations/github/*")
+
+
+async def test_version_switch_reuses_resources(mock_cache_path, patch_bookmarks):
+    docs = {
+        "v1.9.1": {"resources": [{"name": "queue"}, {"name": "shovel"}], "datasources": [], "functions": [], "guides": []},
+        "v1.8.1": {"resources": [{"name": "queue"}, {"name": "exchange"}], "datasources": [], "functions": [], "guides": []},
+    }
+
+    async def registry_get(url, **kwargs):
+        return Response(200, json={"docs": docs[url.split("/")[-2]]})
+
+    with patch("httpx.AsyncClient.get", side_effect=registry_get):
+        provider = Provider.from_json(PROVIDER_JSON)
+        await provider.load_resources(patch_bookmarks())
+        previous = provider.resources
+        provider.active_version = "v1.8.1"
+        await provider.load_resources(patch_bookmarks(), reuse=previous)
+
+    assert [r.name for r in provider.resources] == ["exchange", "queue"]
+    assert provider.resources[1] is previous[0]
+    added, removed = diff_resources(previous, provider.resources)
+    assert [r.name for r in added] == ["exchange"]
+    assert [r.name for r in removed] == ["shovel"]
+    await clear_from_cache("0username/rabbitmq/*")
+
+
+async def test_purge_keeps_bookmarked_documents(mock_cache_path, patch_bookmarks):
+    for version in ("v1.9.1", "v1.8.1"):
+        await save_to_cache(f"0username/rabbitmq/{version}/index.json", "{}")
+        await save_to_cache(f"0username/rabbitmq/{version}/resources/queue.md", "# Queue")
+        await save_to_cache(f"0username/rabbitmq/{version}/resources/shovel.md", "# Shovel")
+    bookmarks = patch_bookmarks()
+    bookmarks.saved["resources"] = ["rabbitmq_resource_queue"]
+    provider = Provider.from_json(PROVIDER_JSON)
+    provider.cached = True
+
+    await provider.clear_from_cache(bookmarks)
+    assert not provider.cached
+    for version in ("v1.9.1", "v1.8.1"):
+        assert await get_from_cache(f"0username/rabbitmq/{version}/resources/queue.md") == "# Queue"
+        assert await get_from_cache(f"0username/rabbitmq/{version}/resources/shovel.md") is None
+        assert await get_from_cache(f"0username/rabbitmq/{version}/index.json") is None
+    await clear_from_cache("0username/rabbitmq/*")
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from tofuref.config import config
+from tofuref.data.scheduler import FetchScheduler, Priority
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(config, "max_concurrent_fetches", 3)
+    monkeypatch.setattr(config, "max_fetches_per_host", 2)
+
+
+async def occupy(scheduler: FetchScheduler, host: str, priority: Priority, started: list, release: asyncio.Event) -> None:
+    async with scheduler.slot(scheduler.ticket(host, priority)):
+        started.append((host, priority))
+        await release.wait()
+
+
+async def test_interactive_preempts_queued_background(limits):
+    scheduler = FetchScheduler()
+    started = []
+    release = asyncio.Event()
+    tasks = [asyncio.create_task(occupy(scheduler, "registry", Priority.BACKGROUND, started, release)) for _ in range(4)]
+    await asyncio.sleep(0)
+    # One slot of the host is kept for interactive requests
+    assert len(started) == 1
+    assert scheduler.waiting == len(tasks) - 1
+
+    tasks.append(asyncio.create_task(occupy(scheduler, "registry", Priority.INTERACTIVE, started, release)))
+    await asyncio.sleep(0)
+    assert started[-1] == ("registry", Priority.INTERACTIVE)
+
+    # Another host has free slots, but prefetching can't take the last ones of the global cap
+    tasks.append(asyncio.create_task(occupy(scheduler, "github", Priority.VISIBLE, started, release)))
+    await asyncio.sleep(0)
+    assert ("github", Priority.VISIBLE) not in started
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert scheduler.running == 0
+    assert scheduler.waiting == 0
+
+
+async def test_waiting_order_and_promotion(limits, monkeypatch):
+    monkeypatch.setattr(config, "max_concurrent_fetches", 1)
+    scheduler = FetchScheduler()
+    order = []
+    running = scheduler.ticket("registry", Priority.INTERACTIVE)
+
+    async def fetch(name: str, priority: Priority) -> None:
+        ticket = scheduler.ticket("registry", priority)
+        tickets[name] = ticket
+        async with scheduler.slot(ticket):
+            order.append(name)
+
+    tickets = {}
+    async with scheduler.slot(running):
+        background = asyncio.create_task(fetch("background", Priority.BACKGROUND))
+        visible = asyncio.create_task(fetch("visible", Priority.VISIBLE))
+        promoted = asyncio.create_task(fetch("promoted", Priority.BACKGROUND))
+        cancelled = asyncio.create_task(fetch("cancelled", Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        scheduler.promote(tickets["promoted"], Priority.INTERACTIVE)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.waiting == len(["background", "visible", "promoted"])
+    await asyncio.gather(background, visible, promoted)
+    assert order == ["promoted", "visible", "background"]
+    assert scheduler.running == 0
+
+
+async def test_release_after_reset(limits):
+    scheduler = FetchScheduler()
+    started = []
+    release = asyncio.Event()
+    granted = asyncio.create_task(occupy(scheduler, "registry", Priority.INTERACTIVE, started, release))
+    waiting = [asyncio.create_task(occupy(scheduler, "registry", Priority.BACKGROUND, started, release)) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert (scheduler.running, scheduler.waiting) == (1, len(waiting))
+    scheduler.reset()
+    await asyncio.gather(*waiting, return_exceptions=True)
+    assert all(task.cancelled() for task in waiting)
+
+    # Granted before the reset, its release doesn't drive the counts negative
+    fresh = asyncio.create_task(occupy(scheduler, "registry", Priority.INTERACTIVE, started, release))
+    await asyncio.sleep(0)
+    assert scheduler.running == 1
+    release.set()
+    await asyncio.gather(granted, fresh)
+    assert scheduler.running == 0
+    assert scheduler.running_by_host["registry"] == 0
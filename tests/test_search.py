@@ -0,0 +1,30 @@
+import json
+from pathlib import Path
+
+from textual.fuzzy import Matcher
+
+from tofuref.data.providers import listed_providers
+from tofuref.data.search import SearchIndex
+
+QUERIES = ["a", "aw", "aws", "hashicorp/a", "gthb", "github", "GitHub", "int/gh", "zzz", "o/", "cloud flare", "nope"]
+
+
+def brute_force(providers: dict, query: str, fuzzy: bool) -> list:
+    if fuzzy:
+        matcher = Matcher(query)
+        scored = [(v, matcher.match(p)) for p, v in providers.items()]
+        return [v for v, s in sorted(scored, key=lambda x: x[1], reverse=True) if s > 0]
+    return [v for p, v in providers.items() if query in p]
+
+
+def test_search_index_matches_brute_force():
+    content = json.loads((Path(__file__).parent.parent / "tofuref" / "fallback" / "providers.json").read_text())
+    providers = {p.display_name: p for p in listed_providers(content)}
+    index = SearchIndex(providers)
+    for fuzzy in (True, False):
+        for query in QUERIES:
+            assert index.search(query, fuzzy) == brute_force(providers, query, fuzzy), query
+        # Typing narrows the previous matches
+        for length in range(1, len("hashicorp/aws") + 1):
+            query = "hashicorp/aws"[:length]
+            assert index.search(query, fuzzy) == brute_force(providers, query, fuzzy), query
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+from textual.worker import WorkerState
+
+from tofuref.data.helpers import NOT_FOUND_TTL, _not_found
+from tofuref.main import TofuRefApp
+from tofuref.startup import StartupTarget
+
+
+async def test_latest_selection_wins(mock_cache_path, mock_http_requests, patch_bookmarks):
+    app = TofuRefApp(startup=StartupTarget(provider="integrations/github"))
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        resources = app.navigation_resources
+        membership = next(option for option in resources.options if option.prompt.name == "membership")
+
+        superseded = app.load_selection(asyncio.Event().wait(), "never finishes")
+        await pilot.pause()
+        await app.load_selection(resources.on_option_selected(membership), "membership").wait()
+        assert superseded.state == WorkerState.CANCELLED
+        assert app.active_resource is membership.prompt
+        assert not app.content_markdown.loading
+
+        # Selecting a provider cancels loading of a resource too
+        superseded = app.load_selection(asyncio.Event().wait(), "never finishes")
+        await pilot.pause()
+        providers = app.navigation_providers
+        await app.load_selection(providers.on_option_selected(providers.highlighted_option), "provider", provider=True).wait()
+        assert superseded.state == WorkerState.CANCELLED
+        assert not resources.loading
+
+
+async def test_missing_document(mock_cache_path, mock_http_requests, patch_bookmarks):
+    app = TofuRefApp(startup=StartupTarget(provider="integrations/github"))
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        resources = app.navigation_resources
+        branch = next(option for option in resources.options if option.prompt.name == "branch")
+        # Registry answered 404 a moment ago
+        _not_found[branch.prompt.endpoint] = time.monotonic() + NOT_FOUND_TTL
+        await app.load_selection(resources.on_option_selected(branch), "branch").wait()
+        assert "was not found in the registry" in app.content_markdown.content
+        assert not branch.prompt.cached
+    _not_found.clear()
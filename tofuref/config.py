@@ -18,9 +18,19 @@ class Config(BaseConfig):
 
     theme: ThemeConfig = field(default_factory=ThemeConfig)
     http_request_timeout: float = 3.0
+    http2: bool = True
+    connectivity_probe_timeout: float = 1.0
+    offline_after_failures: int = 3
     index_cache_duration_days: int = 31
+    cache_compression: str = "auto"
+    cache_backend: str = "files"
+    cache_max_size_mb: int = 512
+    cache_keep_versions: int = 0
     markdown_length_target: int = 40_000
     fuzzy_search: bool = True
+    prefetch_dwell: float = 0.3
+    max_concurrent_fetches: int = 8
+    max_fetches_per_host: int = 6
 
     # Undocumented, for development and experimentation
     show_load_times: bool = False
@@ -0,0 +1,215 @@
+"""
+Portable cache bundles (`tofuref cache export` / `tofuref cache import`) for hosts without access to the registry.
+
+A bundle is a gzipped tar with decompressed cache entries under `entries/` and `bundle.json` listing every entry
+with its size, sha256 and validators. It doesn't depend on the cache backend or compression of either side.
+Import checks the whole bundle before anything is written into the cache.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import tarfile
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import datetime
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+from anyio import to_thread
+
+from tofuref import __version__
+from tofuref.data.cache import MUTABLE_ENDPOINTS, NOT_CACHE_ENTRIES, SQLITE_FILENAME, get_backend, is_cached, load_validators, parse_endpoint
+from tofuref.data.compression import compress, decompress
+
+LOGGER = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = 1
+BUNDLE_MANIFEST = "bundle.json"
+ENTRIES_DIR = "entries"
+
+
+class BundleError(Exception):
+    pass
+
+
+@dataclass
+class BundleResult:
+    entries: int = 0
+    size: int = 0
+    skipped: list[str] = field(default_factory=list)
+
+
+def endpoint_patterns(providers: Iterable[str]) -> list[str]:
+    """
+    >>> endpoint_patterns(["integrations/github", "hashicorp/aws@6.0.0"])
+    ['integrations/github/*', 'hashicorp/aws/v6.0.0/*']
+    """
+    patterns = []
+    for provider in providers:
+        display_name, _, version = provider.partition("@")
+        if version:
+            patterns.append(f"{display_name}/{version if version.startswith('v') else f'v{version}'}/*")
+        else:
+            patterns.append(f"{display_name}/*")
+    return patterns
+
+
+# Names of files the cache keeps next to its entries
+RESERVED_SUFFIXES = (".validators", ".tmp", f"{SQLITE_FILENAME}-wal", f"{SQLITE_FILENAME}-shm")
+
+
+def is_registry_endpoint(endpoint: str) -> bool:
+    """
+    Only endpoints tofuref itself caches can be imported, anything else could overwrite other files in the cache directory
+
+    >>> is_registry_endpoint("hashicorp/aws/v6.0.0/index.md")
+    True
+    >>> is_registry_endpoint("cache.sqlite3")
+    False
+    """
+    if endpoint in NOT_CACHE_ENTRIES or endpoint.startswith(SQLITE_FILENAME) or endpoint.endswith(RESERVED_SUFFIXES):
+        return False
+    if endpoint in MUTABLE_ENDPOINTS:
+        return True
+    segments = endpoint.split("/")
+    if any(segment in ("", ".", "..") for segment in segments):
+        return False
+    return parse_endpoint(endpoint).organization is not None and segments[-1].endswith((".json", ".md"))
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+async def export_bundle(bundle: Path, providers: Iterable[str] = ()) -> BundleResult:
+    """
+    Packs cached entries of given providers (`organization/name` or `organization/name@version`, everything if empty)
+    together with the provider index into a bundle. Unreadable entries are skipped.
+    """
+    patterns = endpoint_patterns(providers)
+    backend = get_backend()
+    endpoints = sorted(entry.endpoint for entry in await backend.usage())
+    if patterns:
+        for pattern in patterns:
+            if not any(fnmatchcase(endpoint, pattern) for endpoint in endpoints):
+                raise BundleError(f"Nothing cached for {pattern.removesuffix('/*')}")
+        endpoints = [e for e in endpoints if e in MUTABLE_ENDPOINTS or any(fnmatchcase(e, pattern) for pattern in patterns)]
+
+    result = BundleResult()
+    listed = []
+    with tarfile.open(bundle, "w:gz") as tar:
+
+        def add(name: str, data: bytes) -> None:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(datetime.now().timestamp())
+            tar.addfile(info, io.BytesIO(data))
+
+        for endpoint in endpoints:
+            contents = await backend.read(endpoint, mark_used=False)
+            try:
+                data = (await to_thread.run_sync(decompress, contents or b"")).encode()
+            except ValueError as e:
+                LOGGER.warning(f"Not exporting unreadable cache entry {endpoint}: {e}")
+                data = b""
+            if not data:
+                result.skipped.append(endpoint)
+                continue
+            await to_thread.run_sync(add, f"{ENTRIES_DIR}/{endpoint}", data)
+            listed.append({"endpoint": endpoint, "size": len(data), "sha256": _sha256(data), "validators": await load_validators(endpoint)})
+            result.entries += 1
+            result.size += len(data)
+        manifest = {"format": BUNDLE_FORMAT, "tofuref": __version__, "entries": listed}
+        await to_thread.run_sync(add, BUNDLE_MANIFEST, json.dumps(manifest).encode())
+    return result
+
+
+def _manifest_entries(manifest: object) -> list[dict]:
+    """
+    Raises:
+        BundleError: manifest doesn't have the shape `export_bundle` writes
+    """
+    entries = manifest.get("entries") if isinstance(manifest, dict) else None
+    if not isinstance(entries, list):
+        raise BundleError("Bundle manifest doesn't list its entries")
+    for entry in entries:
+        if not (
+            isinstance(entry, dict)
+            and isinstance(entry.get("endpoint"), str)
+            and isinstance(entry.get("size"), int)
+            and isinstance(entry.get("sha256"), str)
+            and isinstance(entry.get("validators", {}), dict)
+        ):
+            raise BundleError(f"Bundle manifest has an invalid entry: {entry}")
+    return entries
+
+
+def _verify_bundle(bundle: Path) -> list[dict]:
+    """
+    Raises:
+        BundleError: bundle can't be read, isn't a tofuref bundle or doesn't match its manifest
+    """
+    manifest = None
+    hashes = {}
+    seen = set()
+    try:
+        with tarfile.open(bundle, "r:gz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                # Import writes the first member of a name, the checked one has to be the same
+                if member.name in seen:
+                    raise BundleError(f"Bundle contains {member.name} more than once")
+                seen.add(member.name)
+                data = tar.extractfile(member).read()
+                if member.name == BUNDLE_MANIFEST:
+                    manifest = json.loads(data)
+                elif member.name.startswith(f"{ENTRIES_DIR}/"):
+                    hashes[member.name.removeprefix(f"{ENTRIES_DIR}/")] = (len(data), _sha256(data))
+    except (OSError, tarfile.TarError, EOFError, ValueError) as e:
+        raise BundleError(f"Can't read bundle {bundle}: {e}") from e
+    if not isinstance(manifest, dict) or manifest.get("format") != BUNDLE_FORMAT:
+        raise BundleError(f"{bundle} is not a tofuref cache bundle (format {BUNDLE_FORMAT})")
+    entries = _manifest_entries(manifest)
+    listed = set()
+    for entry in entries:
+        endpoint = entry["endpoint"]
+        if endpoint in listed:
+            raise BundleError(f"Bundle lists {endpoint} more than once")
+        listed.add(endpoint)
+        if not is_registry_endpoint(endpoint):
+            raise BundleError(f"Bundle entry {endpoint} is not a registry endpoint")
+        if endpoint not in hashes:
+            raise BundleError(f"Bundle is missing {endpoint}")
+        if hashes[endpoint] != (entry["size"], entry["sha256"]):
+            raise BundleError(f"Bundle entry {endpoint} is corrupted (size or checksum doesn't match)")
+    return entries
+
+
+async def import_bundle(bundle: Path) -> BundleResult:
+    """
+    Verifies the whole bundle first, then saves its entries into the cache (in the configured backend and compression).
+    Entries already in the cache are skipped, versioned documents don't change and a fresh provider index is newer.
+
+    Raises:
+        BundleError: see `_verify_bundle`
+    """
+    entries = {entry["endpoint"]: entry for entry in await to_thread.run_sync(_verify_bundle, bundle)}
+    result = BundleResult()
+    backend = get_backend()
+    with tarfile.open(bundle, "r:gz") as tar:
+        while (member := await to_thread.run_sync(tar.next)) is not None:
+            endpoint = member.name.removeprefix(f"{ENTRIES_DIR}/")
+            if not member.isfile() or endpoint == member.name or endpoint not in entries:
+                continue
+            if await is_cached(endpoint):
+                result.skipped.append(endpoint)
+                continue
+            data = await to_thread.run_sync(lambda m=member: tar.extractfile(m).read())
+            validators = entries[endpoint].get("validators", {}) if endpoint in MUTABLE_ENDPOINTS else {}
+            await backend.write(endpoint, await to_thread.run_sync(compress, data.decode()), validators)
+            result.entries += 1
+            result.size += len(data)
+    return result
@@ -1,9 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Mapping
 from datetime import datetime
+from fnmatch import fnmatchcase
+from pathlib import Path as SyncPath
+from typing import NamedTuple
 
-from anyio import Path
+from anyio import Path, to_thread
 from platformdirs import user_cache_path
 
 from tofuref.config import config
+from tofuref.data.compression import compress, decompress
+from tofuref.data.stats import STATS_FILENAME, merge_session_stats, stats
+
+LOGGER = logging.getLogger(__name__)
+
+# Only the provider index changes under the same endpoint, everything else is versioned
+MUTABLE_ENDPOINTS = ("index.json",)
+MAX_AGE_REGEX = re.compile(r"max-age=(\d+)")
+SQLITE_FILENAME = "cache.sqlite3"
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 3
+BLOBS_DIRNAME = "blobs"
+# Files in the cache directory that aren't cached responses
+NOT_CACHE_ENTRIES = (MANIFEST_FILENAME, STATS_FILENAME, BLOBS_DIRNAME, "bookmarks.json", "index.snapshot")
+
+DOCUMENT_KINDS = ("resources", "datasources", "guides", "functions")
+# Mostly identical across neighbouring versions of a provider, stored once by content hash
+DEDUPLICATED_KINDS = (*DOCUMENT_KINDS, "overview")
+
+Validators = dict[str, str | int]
+
+
+class CacheKey(NamedTuple):
+    """Structured form of a registry endpoint"""
+
+    organization: str | None
+    name: str | None
+    version: str | None
+    kind: str
+    resource: str | None = None
+
+
+class CacheEntry(NamedTuple):
+    endpoint: str
+    size: int
+    last_used: float
+    # Identifies the body deduplicated entries share, None when the entry has its own
+    blob: str | None = None
+
+
+def parse_endpoint(endpoint: str) -> CacheKey:
+    """
+    >>> parse_endpoint("integrations/github/v6.6.0/resources/membership.md")
+    CacheKey(organization='integrations', name='github', version='v6.6.0', kind='resources', resource='membership')
+    """
+    match endpoint.split("/"):
+        case [organization, name, version, "index.json"]:
+            return CacheKey(organization, name, version, "index")
+        case [organization, name, version, "index.md"]:
+            return CacheKey(organization, name, version, "overview")
+        case [organization, name, version, "metadata.json"]:
+            return CacheKey(organization, name, version, "metadata")
+        case [organization, name, version, kind, resource]:
+            return CacheKey(organization, name, version, kind, resource.removesuffix(".md"))
+        case _:
+            return CacheKey(None, None, None, endpoint)
 
 
 def get_cache_path() -> Path:
@@ -21,7 +89,7 @@ async def cached_file_path(endpoint: str, glob: bool = False) -> Path:
         glob: Looks for glob matches in the cache directory, never use with saving into cache.
 
     Returns:
-        Path to the cached file for a given endpoint.
+        Path to the cached file (of the files backend) for a given endpoint.
         If glob is True, returns the first match, check `exists()`!.
     """
     filename = endpoint.replace("/", "_")
@@ -32,48 +100,701 @@ async def cached_file_path(endpoint: str, glob: bool = False) -> Path:
     return get_cache_path() / filename
 
 
-async def save_to_cache(endpoint: str, contents: str) -> None:
-    if not config.disable_cache:
+def parse_validators(headers: Mapping[str, str]) -> Validators:
+    """Picks the response headers that matter for revalidation and freshness"""
+    validators = {}
+    if etag := headers.get("etag"):
+        validators["etag"] = etag
+    if last_modified := headers.get("last-modified"):
+        validators["last_modified"] = last_modified
+    if max_age := MAX_AGE_REGEX.search(headers.get("cache-control", "")):
+        validators["max_age"] = int(max_age.group(1))
+    return validators
+
+
+class CacheBackend(ABC):
+    """Storage of (already compressed) responses, selected by the `cache_backend` config option"""
+
+    @abstractmethod
+    async def read(self, endpoint: str, mark_used: bool = True) -> bytes | None:
+        """mark_used=False doesn't count the read as a use for eviction (e.g. verification)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def write(self, endpoint: str, contents: bytes, validators: Validators) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def touch(self, endpoint: str, validators: Validators) -> None:
+        """Marks the entry as freshly fetched, replacing its validators"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def fetched_at(self, endpoint: str) -> float | None:
+        """Timestamp of when the entry was fetched (or revalidated), None if it isn't cached"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def validators(self, endpoint: str) -> Validators:
+        raise NotImplementedError
+
+    async def delete(self, endpoint: str) -> int:
+        """Endpoint may contain `*` wildcards, returns the number of bytes freed"""
+        return await self.delete_many([endpoint])
+
+    @abstractmethod
+    async def delete_many(self, endpoints: Iterable[str]) -> int:
+        """
+        Deletes all the endpoints (which may contain `*` wildcards) at once, dropping bodies nothing references anymore
+        in a single pass at the end. Returns the number of bytes freed, shared bodies count only once their last entry is gone.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def cached_providers(self) -> list[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def cached_resources(self, organization: str, name: str, version: str) -> list[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def usage(self) -> list[CacheEntry]:
+        """Every cached entry with its (compressed) size, when it was last written or read and the body it shares, if any"""
+        raise NotImplementedError
+
+    def close(self) -> None:  # noqa: B027
+        """Called once the app (or a CLI command) is done with the cache"""
+
+
+class FilesCacheBackend(CacheBackend):
+    """
+    One file per endpoint, named by replacing `/` with `_`.
+
+    Listing and wildcard deletes go through an in-memory manifest (file name -> size, last used, inode of the blob)
+    instead of globbing the directory.
+    It's built once (scanning the directory), kept up to date on every write and delete,
+    and persisted on close. Persisted manifest carries the directory mtime it was saved with,
+    when anything else (another tofuref process, user) added or removed files since, it's rebuilt.
+    Changes made by someone else while we are running aren't picked up, but they prevent persisting our manifest.
+
+    Documents are content-addressed, stored once in `blobs/<sha256>` and hard linked under the name of every endpoint
+    (of every provider version) they belong to. Blobs that no endpoint links to anymore are removed after deletes.
+    Filesystems without hard links get a plain copy.
+    """
+
+    def __init__(self, path: SyncPath) -> None:
+        self.path = path
+        self._manifest: dict[str, list[int | float | None]] | None = None
+        self._manifest_dirty = False
+        # Directory mtime after our last change of it
+        self._directory_mtime: int | None = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_entry(name: str) -> bool:
+        return name not in NOT_CACHE_ENTRIES and not name.endswith((".validators", ".tmp")) and not name.startswith(SQLITE_FILENAME)
+
+    @staticmethod
+    def _endpoint_from_filename(name: str) -> str:
+        """Reverse of `cached_file_path`, org and provider names don't contain `_`, resource names might"""
+        match name.split("_", 4):
+            case [_, _, _, "index.json" | "index.md" | "metadata.json"] as parts:
+                return "/".join(parts)
+            case [_, _, _, kind, _] as parts if kind in DOCUMENT_KINDS:
+                return "/".join(parts)
+            case _:
+                return name
+
+    def _load_manifest(self) -> dict[str, list[int | float | None]]:
+        with self._lock:
+            if self._manifest is not None:
+                return self._manifest
+            manifest_file = self.path / MANIFEST_FILENAME
+            try:
+                if manifest_file.stat().st_mtime_ns == self.path.stat().st_mtime_ns:
+                    persisted = json.loads(manifest_file.read_text())
+                    if persisted.get("version") == MANIFEST_VERSION:
+                        self._manifest = persisted["entries"]
+                        self._observe_directory()
+                        LOGGER.debug(f"Loaded cache manifest with {len(self._manifest)} entries")
+                        return self._manifest
+            except (OSError, ValueError, AttributeError):
+                pass
+            self._manifest = {}
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if self._is_entry(entry.name) and entry.is_file():
+                        # atime is unreliable (noatime mounts), last write is the best guess of last use
+                        stat = entry.stat()
+                        self._manifest[entry.name] = [stat.st_size, stat.st_mtime, stat.st_ino if stat.st_nlink > 1 else None]
+            self._observe_directory()
+            self._manifest_dirty = True
+            LOGGER.debug(f"Built cache manifest with {len(self._manifest)} entries")
+            return self._manifest
+
+    def _observe_directory(self) -> None:
+        self._directory_mtime = self.path.stat().st_mtime_ns
+
+    def write_auxiliary(self, name: str, contents: bytes) -> None:
+        """Writes a file that isn't a cache entry, without making the manifest look outdated"""
+        with self._lock:
+            unchanged_by_others = self._directory_mtime is not None and self.path.stat().st_mtime_ns == self._directory_mtime
+            _atomic_write_sync(self.path / name, contents)
+            if unchanged_by_others:
+                self._observe_directory()
+
+    async def _get_manifest(self) -> dict[str, list[int | float | None]]:
+        if self._manifest is not None:
+            return self._manifest
+        return await to_thread.run_sync(self._load_manifest)
+
+    def _save_manifest(self) -> None:
+        manifest_file = self.path / MANIFEST_FILENAME
+        tmp_file = manifest_file.with_name(f"{manifest_file.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps({"version": MANIFEST_VERSION, "entries": self._manifest}))
+        tmp_file.replace(manifest_file)
+        # Replacing the manifest was the last change of the directory, both mtimes match until someone else changes it
+        directory_mtime = self.path.stat().st_mtime_ns
+        os.utime(manifest_file, ns=(directory_mtime, directory_mtime))
+        self._manifest_dirty = False
+
+    def close(self) -> None:
+        with self._lock:
+            if self._manifest is None or not self._manifest_dirty:
+                return
+            try:
+                if self.path.stat().st_mtime_ns != self._directory_mtime:
+                    LOGGER.debug("Cache directory was changed by someone else, manifest will be rebuilt next time")
+                    return
+                self._save_manifest()
+            except OSError as e:
+                LOGGER.warning(f"Couldn't save cache manifest: {e}")
+
+    @staticmethod
+    async def _validators_file_path(endpoint: str) -> Path:
+        """Sidecar file next to the cached response, holding the headers needed to revalidate it"""
+        cached_file = await cached_file_path(endpoint)
+        return cached_file.with_name(f"{cached_file.name}.validators")
+
+    @staticmethod
+    async def _atomic_write(file: Path, contents: bytes) -> None:
+        """Readers (even in another tofuref process) see either the old or the new file, never a partial one"""
+        tmp_file = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+        await tmp_file.write_bytes(contents)
+        await tmp_file.replace(file)
+
+    async def _save_validators(self, endpoint: str, validators: Validators) -> None:
+        validators_file = await self._validators_file_path(endpoint)
+        if validators:
+            await validators_file.write_text(json.dumps(validators))
+        elif await validators_file.exists():
+            await validators_file.unlink()
+
+    def _write_linked(self, file: SyncPath, contents: bytes) -> int | None:
+        """Returns the inode of the blob the file is linked to, None if it had to be copied"""
+        blob = self.path / BLOBS_DIRNAME / hashlib.sha256(contents).hexdigest()
+        if not blob.exists():
+            blob.parent.mkdir(exist_ok=True)
+            _atomic_write_sync(blob, contents)
+        tmp_file = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+        tmp_file.unlink(missing_ok=True)
+        try:
+            os.link(blob, tmp_file)
+        except OSError:
+            # No hard links on this filesystem (or the blob was just collected by another process)
+            tmp_file.write_bytes(contents)
+            tmp_file.replace(file)
+            return None
+        tmp_file.replace(file)
+        return file.stat().st_ino
+
+    def _collect_garbage(self) -> None:
+        """Removes blobs only the blob store itself links to"""
+        removed = 0
+        try:
+            for blob in (self.path / BLOBS_DIRNAME).iterdir():
+                # Temporary files are blobs being written
+                if not blob.name.endswith(".tmp") and blob.stat().st_nlink <= 1:
+                    blob.unlink(missing_ok=True)
+                    removed += 1
+        except FileNotFoundError:
+            return
+        if removed:
+            LOGGER.debug(f"Removed {removed} unreferenced blobs")
+
+    async def read(self, endpoint: str, mark_used: bool = True) -> bytes | None:
+        cached_file = await cached_file_path(endpoint)
+        try:
+            contents = await cached_file.read_bytes()
+        except FileNotFoundError:
+            return None
+        if not mark_used:
+            return contents
+        manifest = await self._get_manifest()
+        if cached_file.name in manifest:
+            manifest[cached_file.name][1] = datetime.now().timestamp()
+        else:
+            manifest[cached_file.name] = [len(contents), datetime.now().timestamp(), None]
+        self._manifest_dirty = True
+        return contents
+
+    async def write(self, endpoint: str, contents: bytes, validators: Validators) -> None:
+        manifest = await self._get_manifest()
         cached_file = await cached_file_path(endpoint)
-        await cached_file.write_text(contents)
+        inode = None
+        if parse_endpoint(endpoint).kind in DEDUPLICATED_KINDS:
+            inode = await to_thread.run_sync(self._write_linked, SyncPath(cached_file), contents)
+        else:
+            await self._atomic_write(cached_file, contents)
+        manifest[cached_file.name] = [len(contents), datetime.now().timestamp(), inode]
+        self._manifest_dirty = True
+        if endpoint in MUTABLE_ENDPOINTS:
+            await self._save_validators(endpoint, validators)
+        await to_thread.run_sync(self._observe_directory)
+
+    async def touch(self, endpoint: str, validators: Validators) -> None:
+        await (await cached_file_path(endpoint)).touch()
+        if endpoint in MUTABLE_ENDPOINTS:
+            await self._save_validators(endpoint, validators)
+            await to_thread.run_sync(self._observe_directory)
+
+    async def fetched_at(self, endpoint: str) -> float | None:
+        try:
+            return (await (await cached_file_path(endpoint)).stat()).st_mtime
+        except FileNotFoundError:
+            return None
+
+    async def validators(self, endpoint: str) -> Validators:
+        validators_file = await self._validators_file_path(endpoint)
+        if not await validators_file.exists():
+            return {}
+        try:
+            return json.loads(await validators_file.read_text())
+        except ValueError:
+            return {}
+
+    async def delete_many(self, endpoints: Iterable[str]) -> int:
+        manifest = await self._get_manifest()
+        names: set[str] = set()
+        for endpoint in endpoints:
+            pattern = (await cached_file_path(endpoint)).name
+            if "*" in pattern:
+                names.update(name for name in manifest if fnmatchcase(name, pattern))
+            else:
+                names.add(pattern)
+        deleted = [manifest[name] for name in names if name in manifest]
+        linked = any(inode is not None for _, _, inode in deleted)
+
+        def unlink() -> None:
+            for name in names:
+                (self.path / name).unlink(missing_ok=True)
+                (self.path / f"{name}.validators").unlink(missing_ok=True)
+            self._observe_directory()
+            if linked:
+                self._collect_garbage()
+
+        await to_thread.run_sync(unlink)
+        for name in names:
+            manifest.pop(name, None)
+        self._manifest_dirty = True
+        # A blob is freed with its last link
+        remaining = {inode for _, _, inode in manifest.values()} if linked else set()
+        blobs = {inode: size for size, _, inode in deleted if inode is not None and inode not in remaining}
+        return sum(size for size, _, inode in deleted if inode is None) + sum(blobs.values())
+
+    async def cached_providers(self) -> list[str]:
+        cached = [name.removesuffix(".json") for name in await self._get_manifest() if fnmatchcase(name, "*_index.json")]
+        return [f"{c.split('_')[0]}/{c.split('_')[1]}" for c in cached]
+
+    async def cached_resources(self, organization: str, name: str, version: str) -> list[str]:
+        pattern = f"{organization}_{name}_{version}_*_*.md"
+        cached = [n.removesuffix(".md") for n in await self._get_manifest() if fnmatchcase(n, pattern)]
+        return [f"{c.split('_')[3]}/{'_'.join(c.split('_')[4:]).split('.')[0]}" for c in cached]
+
+    async def usage(self) -> list[CacheEntry]:
+        manifest = await self._get_manifest()
+        return [
+            CacheEntry(self._endpoint_from_filename(name), size, last_used, None if inode is None else str(inode))
+            for name, (size, last_used, inode) in manifest.items()
+        ]
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    All entries in a single SQLite database, with the endpoint split into indexed columns.
+
+    Marking cached items, wildcard clears and stats are single queries instead of directory globbing.
+    sqlite3 is blocking, every query runs in a worker thread, serialized by a lock.
+
+    Documents are content-addressed, their bodies live once in `blobs` (keyed by sha256) and entries only reference them.
+    Deletes drop blobs no deleted entry referenced and no remaining one references.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        endpoint TEXT PRIMARY KEY,
+        organization TEXT,
+        name TEXT,
+        version TEXT,
+        kind TEXT NOT NULL,
+        resource TEXT,
+        fetched_at REAL NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        max_age INTEGER,
+        size INTEGER NOT NULL,
+        last_used REAL NOT NULL,
+        body BLOB NOT NULL,
+        blob TEXT
+    );
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        body BLOB NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_provider_version ON entries (organization, name, version, kind);
+    CREATE INDEX IF NOT EXISTS entries_kind ON entries (kind);
+    """
+    # Columns missing in databases created by older versions, in the order they were added
+    MIGRATIONS = (
+        # Last use wasn't tracked, the last fetch is the best guess
+        ("last_used", "ALTER TABLE entries ADD COLUMN last_used REAL NOT NULL DEFAULT 0; UPDATE entries SET last_used = fetched_at;"),
+        ("blob", "ALTER TABLE entries ADD COLUMN blob TEXT;"),
+    )
+    # Migrated databases have the columns in a different order, inserts name them
+    COLUMNS = "endpoint, organization, name, version, kind, resource, fetched_at, etag, last_modified, max_age, size, last_used, body, blob"
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            # Several tofuref sessions may share the cache, WAL lets readers work while another one writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA busy_timeout=5000")
+            self._connection.executescript(self.SCHEMA)
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(entries)")}
+            for column, migration in self.MIGRATIONS:
+                if column not in columns:
+                    self._connection.executescript(migration)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entries_blob ON entries (blob) WHERE blob IS NOT NULL")
+        return self._connection
+
+    async def _execute(self, query: str, parameters: tuple = ()) -> list[tuple]:
+        def run() -> list[tuple]:
+            with self._lock:
+                return self._connect().execute(query, parameters).fetchall()
+
+        return await to_thread.run_sync(run)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    async def read(self, endpoint: str, mark_used: bool = True) -> bytes | None:
+        def run() -> bytes | None:
+            with self._lock:
+                connection = self._connect()
+                row = connection.execute(
+                    "SELECT COALESCE(blobs.body, entries.body) FROM entries LEFT JOIN blobs ON blobs.hash = entries.blob WHERE endpoint = ?",
+                    (endpoint,),
+                ).fetchone()
+                if row is not None and mark_used:
+                    connection.execute("UPDATE entries SET last_used = ? WHERE endpoint = ?", (datetime.now().timestamp(), endpoint))
+                return row[0] if row else None
+
+        return await to_thread.run_sync(run)
+
+    async def write(self, endpoint: str, contents: bytes, validators: Validators) -> None:
+        key = parse_endpoint(endpoint)
+        now = datetime.now().timestamp()
+        blob = hashlib.sha256(contents).hexdigest() if key.kind in DEDUPLICATED_KINDS else None
+        entry = (
+            endpoint,
+            *key,
+            now,
+            validators.get("etag"),
+            validators.get("last_modified"),
+            validators.get("max_age"),
+            len(contents),
+            now,
+            b"" if blob else contents,
+            blob,
+        )
+
+        def run() -> None:
+            with self._lock:
+                connection = self._connect()
+                connection.execute("BEGIN")
+                try:
+                    if blob:
+                        connection.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?)", (blob, contents))
+                    placeholders = ", ".join("?" * len(entry))
+                    connection.execute(f"INSERT OR REPLACE INTO entries ({self.COLUMNS}) VALUES ({placeholders})", entry)
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+                connection.execute("COMMIT")
+
+        await to_thread.run_sync(run)
+
+    async def touch(self, endpoint: str, validators: Validators) -> None:
+        await self._execute(
+            "UPDATE entries SET fetched_at = ?, etag = ?, last_modified = ?, max_age = ? WHERE endpoint = ?",
+            (datetime.now().timestamp(), validators.get("etag"), validators.get("last_modified"), validators.get("max_age"), endpoint),
+        )
+
+    async def fetched_at(self, endpoint: str) -> float | None:
+        rows = await self._execute("SELECT fetched_at FROM entries WHERE endpoint = ?", (endpoint,))
+        return rows[0][0] if rows else None
+
+    async def validators(self, endpoint: str) -> Validators:
+        rows = await self._execute("SELECT etag, last_modified, max_age FROM entries WHERE endpoint = ?", (endpoint,))
+        if not rows:
+            return {}
+        return {k: v for k, v in zip(("etag", "last_modified", "max_age"), rows[0], strict=True) if v is not None}
+
+    async def delete_many(self, endpoints: Iterable[str]) -> int:
+        def run() -> int:
+            with self._lock:
+                connection = self._connect()
+                connection.execute("BEGIN")
+                try:
+                    freed = 0
+                    blobs: dict[str, int] = {}
+                    for endpoint in endpoints:
+                        # GLOB is case-sensitive, so the primary key index is used for the prefix before the first wildcard
+                        for size, blob in connection.execute("SELECT size, blob FROM entries WHERE endpoint GLOB ?", (endpoint,)).fetchall():
+                            if blob is None:
+                                freed += size
+                            else:
+                                blobs[blob] = size
+                        connection.execute("DELETE FROM entries WHERE endpoint GLOB ?", (endpoint,))
+                    # Only blobs of the deleted entries can become unreferenced, each one is a lookup in the `entries_blob` index
+                    for blob, size in blobs.items():
+                        if connection.execute("SELECT 1 FROM entries WHERE blob = ? LIMIT 1", (blob,)).fetchone() is None:
+                            connection.execute("DELETE FROM blobs WHERE hash = ?", (blob,))
+                            freed += size
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+                connection.execute("COMMIT")
+                return freed
+
+        return await to_thread.run_sync(run)
+
+    async def cached_providers(self) -> list[str]:
+        rows = await self._execute("SELECT DISTINCT organization, name FROM entries WHERE kind = 'index'")
+        return [f"{organization}/{name}" for organization, name in rows]
+
+    async def cached_resources(self, organization: str, name: str, version: str) -> list[str]:
+        rows = await self._execute(
+            "SELECT kind, resource FROM entries WHERE organization = ? AND name = ? AND version = ? AND resource IS NOT NULL",
+            (organization, name, version),
+        )
+        return [f"{kind}/{resource}" for kind, resource in rows]
+
+    async def usage(self) -> list[CacheEntry]:
+        rows = await self._execute("SELECT endpoint, size, last_used, blob FROM entries")
+        return [CacheEntry(*row) for row in rows]
+
+
+_backends: dict[tuple[str, str], CacheBackend] = {}
+
+
+def get_backend() -> CacheBackend:
+    """Backend for the configured `cache_backend` (`files` or `sqlite`) and the current cache path"""
+    key = (config.cache_backend, str(get_cache_path()))
+    if key not in _backends:
+        if config.cache_backend == "sqlite":
+            _backends[key] = SQLiteCacheBackend(get_cache_path() / SQLITE_FILENAME)
+        else:
+            _backends[key] = FilesCacheBackend(SyncPath(get_cache_path()))
+    return _backends[key]
+
+
+def _atomic_write_sync(file: SyncPath, contents: bytes) -> None:
+    tmp_file = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+    tmp_file.write_bytes(contents)
+    tmp_file.replace(file)
+
+
+def write_cache_file(name: str, contents: bytes) -> None:
+    """Atomically writes a file that isn't a cache entry (snapshot, stats) into the cache directory, blocking"""
+    backend = _backends.get(("files", str(get_cache_path())))
+    if isinstance(backend, FilesCacheBackend):
+        backend.write_auxiliary(name, contents)
+    else:
+        _atomic_write_sync(SyncPath(get_cache_path()) / name, contents)
+
+
+def close_cache() -> None:
+    try:
+        if (merged_stats := merge_session_stats(SyncPath(get_cache_path()))) is not None:
+            write_cache_file(STATS_FILENAME, merged_stats)
+    except OSError as e:
+        LOGGER.warning(f"Couldn't save cache stats: {e}")
+    for backend in _backends.values():
+        backend.close()
+    _backends.clear()
 
 
-async def is_provider_index_expired(file: Path) -> bool:
+async def save_to_cache(endpoint: str, contents: str, headers: Mapping[str, str] | None = None) -> None:
+    if not config.disable_cache:
+        validators = parse_validators(headers or {}) if endpoint in MUTABLE_ENDPOINTS else {}
+        compressed = await to_thread.run_sync(compress, contents)
+        await get_backend().write(endpoint, compressed, validators)
+        stats.bytes_written += len(compressed)
+
+
+async def load_validators(endpoint: str) -> Validators:
+    return await get_backend().validators(endpoint)
+
+
+async def get_revalidation_headers(endpoint: str) -> dict[str, str]:
+    """Conditional request headers for a cached (expired) response, empty if there is nothing to revalidate"""
+    if config.disable_cache:
+        return {}
+    validators = await load_validators(endpoint)
+    headers = {}
+    if "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if "last_modified" in validators:
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+async def refresh_cache(endpoint: str, headers: Mapping[str, str]) -> None:
+    """The registry confirmed (304) that our copy is current, make it fresh again without downloading it"""
+    if not config.disable_cache:
+        # 304 may omit validators that didn't change, keep the ones we have
+        validators = {**await load_validators(endpoint), **parse_validators(headers)} if endpoint in MUTABLE_ENDPOINTS else {}
+        await get_backend().touch(endpoint, validators)
+
+
+async def is_expired(endpoint: str, fetched_at: float) -> bool:
     """
-    Provider index is mutable, we consider it expired after 31 days (unconfigurable for now)
+    Provider index is mutable, we consider it expired after `max-age` sent by the registry,
+    or after `index_cache_duration_days` (31 by default) if the registry didn't send any.
 
-    One request per month is not too bad (we could have static fallback for the cases where this is hit when offline).
-    New providers that people actually want probably won't be showing too often, so a month should be okay.
+    Expired index is revalidated with a conditional request, so refreshing an unchanged index is cheap.
     """
-    timeout = config.index_cache_duration_days * 86400
+    if endpoint not in MUTABLE_ENDPOINTS:
+        return False
+    validators = await load_validators(endpoint)
+    timeout = validators.get("max_age", config.index_cache_duration_days * 86400)
     now = datetime.now().timestamp()
-    return file == await cached_file_path("index.json") and now - (await file.stat()).st_mtime >= timeout
+    return now - fetched_at >= timeout
+
+
+async def is_cached(endpoint: str) -> bool:
+    """Whether `get_from_cache` would be a hit, without reading the entry"""
+    if config.disable_cache:
+        return False
+    fetched_at = await get_backend().fetched_at(endpoint)
+    return fetched_at is not None and not await is_expired(endpoint, fetched_at)
 
 
-async def get_from_cache(endpoint: str) -> str | None:
-    """Loads from cache, unless the provider index is expired or cache is disabled in config"""
-    cached_file = await cached_file_path(endpoint)
-    if not await cached_file.exists() or await is_provider_index_expired(cached_file) or config.disable_cache:
+async def get_from_cache(endpoint: str, allow_expired: bool = False) -> str | None:
+    """Loads from cache, unless the provider index is expired (and allow_expired is False) or cache is disabled in config"""
+    if config.disable_cache:
         return None
-    return await cached_file.read_text()
+    if not allow_expired and not await is_cached(endpoint):
+        return None
+    contents = await get_backend().read(endpoint)
+    if contents is None:
+        return None
+    stats.bytes_read += len(contents)
+    try:
+        return await to_thread.run_sync(decompress, contents)
+    except ValueError as e:
+        LOGGER.warning(f"Ignoring unreadable cache entry {endpoint}: {e}")
+        return None
+
 
+async def clear_from_cache(endpoint: str) -> int:
+    """Removes all cached entries (for all versions if given with a wildcard) for a given endpoint, returns the bytes freed"""
+    return await get_backend().delete(endpoint)
 
-async def clear_from_cache(endpoint: str) -> None:
-    """Removes all cached files (for all versions if given with a wildcard) for a given endpoint"""
-    cached_file = await cached_file_path(endpoint, glob=True)
-    while await cached_file.exists():
-        await cached_file.unlink()
-        # Load another
-        cached_file = await cached_file_path(endpoint, glob=True)
+
+async def clear_many_from_cache(endpoints: Iterable[str]) -> int:
+    """Like `clear_from_cache` for many endpoints at once, unreferenced bodies are collected once at the end"""
+    return await get_backend().delete_many(endpoints)
+
+
+async def get_cache_usage() -> list[CacheEntry]:
+    """For eviction and stats"""
+    return await get_backend().usage()
 
 
 async def get_cached_providers() -> list[str]:
     """For optimized marking of cached providers"""
-    cached = [f.stem async for f in get_cache_path().glob("*_index.json")]
-    return [f"{c.split('_')[0]}/{c.split('_')[1]}" for c in cached]
+    return await get_backend().cached_providers()
 
 
 async def get_cached_resources(organization, name, version) -> list[str]:
     """For optimized marking of cached resources"""
-    cached = [f.stem async for f in get_cache_path().glob(f"{organization}_{name}_{version}_*_*.md")]
-    return [f"{c.split('_')[3]}/{'_'.join(c.split('_')[4:]).split('.')[0]}" for c in cached]
+    return await get_backend().cached_resources(organization, name, version)
+
+
+class CacheProblem(NamedTuple):
+    endpoint: str
+    problem: str
+
+
+async def verify_cache() -> list[CacheProblem]:
+    """
+    Reads every cached entry (without counting it as used for eviction) and reports
+    missing or empty bodies, entries that can't be decompressed and JSON that can't be parsed.
+    """
+    backend = get_backend()
+    problems = []
+    for entry in await backend.usage():
+        contents = await backend.read(entry.endpoint, mark_used=False)
+        if not contents:
+            problems.append(CacheProblem(entry.endpoint, "missing body" if contents is None else "empty body"))
+            continue
+        try:
+            text = await to_thread.run_sync(decompress, contents)
+        except ValueError as e:
+            problems.append(CacheProblem(entry.endpoint, f"unreadable: {e}"))
+            continue
+        if not text:
+            problems.append(CacheProblem(entry.endpoint, "empty body"))
+        elif entry.endpoint.endswith(".json"):
+            try:
+                json.loads(text)
+            except ValueError:
+                problems.append(CacheProblem(entry.endpoint, "invalid JSON"))
+    return problems
+
+
+def total_size(entries: Iterable[CacheEntry]) -> int:
+    """Bytes the entries take up on disk, a body shared by deduplicated entries counts once"""
+    blobs = {}
+    total = 0
+    for entry in entries:
+        if entry.blob is None:
+            total += entry.size
+        else:
+            blobs[entry.blob] = entry.size
+    return total + sum(blobs.values())
+
+
+def usage_by_version(entries: list[CacheEntry]) -> dict[tuple[str, str], int]:
+    """
+    (`organization/name`, version) -> bytes, entries that don't belong to a provider version are under (endpoint, "")
+
+    Bodies shared with other versions count for each of them, the sum can be more than `total_size`.
+    """
+    groups: dict[tuple[str, str], list[CacheEntry]] = {}
+    for entry in entries:
+        key = parse_endpoint(entry.endpoint)
+        group = (f"{key.organization}/{key.name}", key.version) if key.version else (entry.endpoint, "")
+        groups.setdefault(group, []).append(entry)
+    return {group: total_size(group_entries) for group, group_entries in groups.items()}
@@ -0,0 +1,81 @@
+"""
+Transparent compression of cached documents.
+
+Compressed entries are recognized by the magic bytes of their format, anything else is a plain UTF-8 file
+(the format used before compression was introduced), so old cache entries keep working.
+"""
+
+import gzip
+import logging
+
+from tofuref.config import config
+
+LOGGER = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+try:
+    # Python 3.14+
+    from compression import zstd as _zstd
+
+    def _zstd_compress(data: bytes) -> bytes:
+        return _zstd.compress(data, level=ZSTD_LEVEL)
+
+    def _zstd_decompress(data: bytes) -> bytes:
+        return _zstd.decompress(data)
+
+    ZSTD_AVAILABLE = True
+except ImportError:
+    try:
+        import zstandard as _zstd
+
+        def _zstd_compress(data: bytes) -> bytes:
+            return _zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+        def _zstd_decompress(data: bytes) -> bytes:
+            return _zstd.ZstdDecompressor().decompress(data)
+
+        ZSTD_AVAILABLE = True
+    except ImportError:
+        ZSTD_AVAILABLE = False
+
+
+def compression_format() -> str:
+    """Format for newly written entries, resolved from `cache_compression` config"""
+    wanted = config.cache_compression
+    if wanted == "auto":
+        return "zstd" if ZSTD_AVAILABLE else "gzip"
+    if wanted == "zstd" and not ZSTD_AVAILABLE:
+        LOGGER.warning("zstd compression is not available (install tofuref[zstd]), using gzip")
+        return "gzip"
+    return wanted
+
+
+def compress(text: str) -> bytes:
+    data = text.encode()
+    match compression_format():
+        case "zstd":
+            return _zstd_compress(data)
+        case "gzip":
+            return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+        case _:
+            return data
+
+
+def decompress(data: bytes) -> str:
+    """Raises ValueError for entries that can't be read (corrupted, or zstd that isn't available)"""
+    try:
+        if data.startswith(GZIP_MAGIC):
+            data = gzip.decompress(data)
+        elif data.startswith(ZSTD_MAGIC):
+            if not ZSTD_AVAILABLE:
+                raise ValueError("Entry is compressed with zstd, which is not available")
+            data = _zstd_decompress(data)
+        return data.decode()
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Corrupted entry: {e}") from e
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from collections.abc import Callable
+from importlib.util import find_spec
+
+import httpx
+
+from tofuref import __version__
+from tofuref.config import config
+
+LOGGER = logging.getLogger(__name__)
+
+REGISTRY_URL = "https://api.opentofu.org/"
+RETRY_INITIAL_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+
+_http_client: httpx.AsyncClient | None = None
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (`pip install tofuref[http2]`)"""
+    return config.http2 and find_spec("h2") is not None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Shared client for all outgoing traffic (registry, GitHub, PyPI).
+
+    Keeping one client for the lifetime of the app means connections are pooled and kept alive,
+    so loading a provider's overview and index together pays for a single TCP+TLS handshake.
+    The client is created lazily and owned by whoever calls `close_http_client` (the app on shutdown).
+    """
+    global _http_client  # noqa: PLW0603
+    if _http_client is None or _http_client.is_closed:
+        LOGGER.debug("Starting shared async client")
+        _http_client = httpx.AsyncClient(
+            headers={"User-Agent": f"tofuref v{__version__}"},
+            http2=http2_available(),
+            timeout=config.http_request_timeout,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=60),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client  # noqa: PLW0603
+    if _http_client is not None:
+        LOGGER.debug("Closing shared async client")
+        await _http_client.aclose()
+        _http_client = None
+
+
+class Connectivity:
+    """
+    Circuit breaker for the registry.
+
+    After `offline_after_failures` consecutive failed requests (or a failed probe), we switch to offline mode,
+    where cache misses are answered right away instead of waiting for a timeout. While offline,
+    the registry is probed in the background with exponential backoff, first successful probe brings us back online.
+    """
+
+    def __init__(self) -> None:
+        self.offline = False
+        self.failures = 0
+        self._listeners: list[Callable[[bool], None]] = []
+        self._retry_task: asyncio.Task | None = None
+
+    def add_listener(self, listener: Callable[[bool], None]) -> None:
+        """Listener gets called with the new offline state, whenever it changes"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[bool], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.offline:
+            self._set_offline(False)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if not self.offline and self.failures >= config.offline_after_failures:
+            self._set_offline(True)
+
+    async def probe(self) -> bool:
+        """
+        Fast check whether the registry is reachable, any response counts.
+        The connection it opens stays in the pool for the request that follows.
+        """
+        try:
+            await get_http_client().head(REGISTRY_URL, timeout=config.connectivity_probe_timeout)
+        except httpx.HTTPError as e:
+            LOGGER.info(f"Registry is unreachable: {e!r}")
+            self.failures = max(self.failures, config.offline_after_failures)
+            if not self.offline:
+                self._set_offline(True)
+            return False
+        self.record_success()
+        return True
+
+    def reset(self) -> None:
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            self._retry_task = None
+        self.offline = False
+        self.failures = 0
+
+    def _set_offline(self, offline: bool) -> None:
+        LOGGER.warning("Switching to offline mode, serving from cache only" if offline else "Registry is reachable again")
+        self.offline = offline
+        if offline and self._retry_task is None:
+            self._retry_task = asyncio.create_task(self._retry())
+        for listener in self._listeners:
+            listener(offline)
+
+    async def _retry(self) -> None:
+        delay = RETRY_INITIAL_DELAY
+        try:
+            while self.offline:
+                await asyncio.sleep(delay)
+                if await self.probe():
+                    break
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+        finally:
+            self._retry_task = None
+
+
+connectivity = Connectivity()
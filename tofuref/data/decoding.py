@@ -0,0 +1,103 @@
+"""
+JSON decoding of registry payloads.
+
+With msgspec installed (`tofuref[fast-json]`), the provider index and per-version indexes are decoded
+straight into typed dicts holding only the fields tofuref uses. Otherwise orjson is used when available,
+and stdlib json as the last resort. All of them produce the same plain dicts.
+"""
+
+import json
+import logging
+from typing import Any, TypedDict
+
+from tofuref.data.cache import parse_endpoint
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _Address(TypedDict):
+    namespace: str
+    name: str
+
+
+class _ForkOf(TypedDict, total=False):
+    display: str
+
+
+class _Version(TypedDict):
+    id: str
+
+
+class _ProviderRequired(TypedDict):
+    addr: _Address
+    description: str
+    fork_count: int
+    is_blocked: bool
+    popularity: int
+    versions: list[_Version]
+
+
+class _Provider(_ProviderRequired, total=False):
+    fork_of: _ForkOf
+
+
+class ProviderIndex(TypedDict):
+    providers: list[_Provider]
+
+
+class _Doc(TypedDict):
+    name: str
+
+
+class _Docs(TypedDict):
+    resources: list[_Doc]
+    datasources: list[_Doc]
+    functions: list[_Doc]
+    guides: list[_Doc]
+
+
+class VersionIndex(TypedDict):
+    docs: _Docs
+
+
+def decoder_name() -> str:
+    if msgspec is not None:
+        return "msgspec"
+    if orjson is not None:
+        return "orjson"
+    return "json"
+
+
+def schema_for(endpoint: str) -> type | None:
+    """Typed schema of a registry endpoint, None if it's not one we know"""
+    if endpoint == "index.json":
+        return ProviderIndex
+    if parse_endpoint(endpoint).kind == "index":
+        return VersionIndex
+    return None
+
+
+def decode_json(content: str | bytes, schema: type | None = None) -> Any:
+    """
+    Raises:
+        ValueError: content isn't valid JSON
+    """
+    if msgspec is not None and schema is not None:
+        try:
+            return msgspec.json.decode(content, type=schema)
+        except msgspec.DecodeError as e:
+            # Registry changed its schema (or the content is broken), untyped decoding will tell
+            LOGGER.debug(f"Typed decoding failed, falling back: {e}")
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
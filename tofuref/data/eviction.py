@@ -0,0 +1,113 @@
+"""
+Keeps the cache within `cache_max_size_mb` and `cache_keep_versions`.
+
+Provider index and bookmarked providers/resources are never evicted.
+Everything else goes least-recently-used first, in small batches, so it can run in the background.
+"""
+
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from packaging.version import InvalidVersion, Version
+
+from tofuref.config import config
+from tofuref.data.bookmarks import Bookmarks
+from tofuref.data.cache import MUTABLE_ENDPOINTS, CacheEntry, CacheKey, clear_many_from_cache, get_cache_usage, parse_endpoint, total_size
+
+LOGGER = logging.getLogger(__name__)
+
+EVICTION_BATCH_SIZE = 50
+
+
+@dataclass
+class EvictionResult:
+    evicted: int = 0
+    freed_bytes: int = 0
+    total_bytes: int = 0
+
+
+def is_protected(entry: CacheEntry, bookmarks: Bookmarks) -> bool:
+    if entry.endpoint in MUTABLE_ENDPOINTS:
+        return True
+    key = parse_endpoint(entry.endpoint)
+    if key.organization is None:
+        return False
+    if bookmarks.check("providers", f"{key.organization}/{key.name}"):
+        return True
+    return is_bookmarked_document(key, bookmarks)
+
+
+def is_bookmarked_document(key: CacheKey, bookmarks: Bookmarks) -> bool:
+    # Same format as `Resource.identifying_name`
+    return key.resource is not None and bookmarks.check("resources", f"{key.name}_{key.kind.removesuffix('s')}_{key.resource}")
+
+
+def _version_key(version: str) -> tuple[int, Version | str]:
+    try:
+        return 1, Version(version)
+    except InvalidVersion:
+        # Unparsable versions are considered the oldest
+        return 0, version
+
+
+def old_versions(entries: list[CacheEntry], keep: int) -> set[tuple[str, str, str]]:
+    """(organization, name, version) of cached versions beyond the newest `keep` of each provider"""
+    versions = defaultdict(set)
+    for entry in entries:
+        key = parse_endpoint(entry.endpoint)
+        if key.version is not None:
+            versions[(key.organization, key.name)].add(key.version)
+    return {
+        (organization, name, version)
+        for (organization, name), provider_versions in versions.items()
+        for version in sorted(provider_versions, key=_version_key, reverse=True)[keep:]
+    }
+
+
+def select_for_eviction(entries: list[CacheEntry], bookmarks: Bookmarks) -> list[CacheEntry]:
+    """Versions beyond `cache_keep_versions` first, then least recently used entries until the cache fits `cache_max_size_mb`"""
+    candidates = sorted((e for e in entries if not is_protected(e, bookmarks)), key=lambda e: e.last_used)
+    selected = []
+    # Shared bodies take up space until their last entry is selected
+    references = Counter(e.blob for e in entries if e.blob is not None)
+
+    def frees(entry: CacheEntry) -> int:
+        if entry.blob is None:
+            return entry.size
+        references[entry.blob] -= 1
+        return entry.size if references[entry.blob] == 0 else 0
+
+    if config.cache_keep_versions > 0:
+        outdated = old_versions(entries, config.cache_keep_versions)
+        selected = [e for e in candidates if parse_endpoint(e.endpoint)[:3] in outdated]
+        candidates = [e for e in candidates if parse_endpoint(e.endpoint)[:3] not in outdated]
+
+    if config.cache_max_size_mb > 0:
+        excess = total_size(entries) - sum(frees(e) for e in selected) - config.cache_max_size_mb * 1024 * 1024
+        for entry in candidates:
+            if excess <= 0:
+                break
+            selected.append(entry)
+            excess -= frees(entry)
+    return selected
+
+
+async def evict(bookmarks: Bookmarks) -> EvictionResult:
+    entries = await get_cache_usage()
+    result = EvictionResult(total_bytes=total_size(entries))
+    selected = select_for_eviction(entries, bookmarks)
+    if not selected:
+        return result
+
+    LOGGER.info(f"Evicting {len(selected)} cached entries")
+    for i in range(0, len(selected), EVICTION_BATCH_SIZE):
+        batch = selected[i : i + EVICTION_BATCH_SIZE]
+        result.freed_bytes += await clear_many_from_cache(e.endpoint for e in batch)
+        result.evicted += len(batch)
+        # Let the UI breathe between batches
+        await asyncio.sleep(0)
+    result.total_bytes -= result.freed_bytes
+    LOGGER.info(f"Evicted {result.evicted} cached entries, freed {result.freed_bytes} bytes")
+    return result
@@ -1,41 +1,263 @@
-import json as jsonlib
+import asyncio
 import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field, replace
+from enum import Enum
+from functools import partial
 
 import httpx
 
-from tofuref import __version__
 from tofuref.config import config
-from tofuref.data.cache import cached_file_path, get_from_cache, save_to_cache
+from tofuref.data.cache import DOCUMENT_KINDS, get_from_cache, get_revalidation_headers, parse_endpoint, refresh_cache, save_to_cache
+from tofuref.data.connectivity import connectivity, get_http_client
+from tofuref.data.decoding import decode_json, schema_for
+from tofuref.data.metadata import save_doc_metadata
+from tofuref.data.scheduler import Priority, Ticket, scheduler
+from tofuref.data.stats import stats
 
 LOGGER = logging.getLogger(__name__)
 
 CODEBLOCK_REGEX = r"^```([a-z]+)\n([\s\S]*?)^```"
+REGISTRY_API_URL = "https://api.opentofu.org/registry/docs/providers/"
+REGISTRY_HOST = httpx.URL(REGISTRY_API_URL).host
+# How long (in seconds) the registry isn't asked again for an endpoint it doesn't have
+NOT_FOUND_TTL = 300.0
+# Beginning of a downloading document that's enough to fill the first screen
+STREAM_PREVIEW_SIZE = 8 * 1024
 
+# Called with the beginning of a document while the rest is still downloading
+PreviewCallback = Callable[[str], Awaitable[None]]
 
-async def get_registry_api(endpoint: str, json: bool = True) -> dict[str, dict] | str:
+
+class FetchStatus(Enum):
+    OK = "ok"
+    STALE = "stale"
+    """Expired cached copy, the registry couldn't be asked or failed"""
+    NOT_FOUND = "not found"
+    UNAVAILABLE = "unavailable"
+    """Request failed (or offline) and nothing is cached"""
+
+
+@dataclass(frozen=True, slots=True)
+class RegistryResponse:
+    status: FetchStatus
+    content: dict[str, dict] | str = ""
+    http_status: int | None = None
+
+    @property
+    def available(self) -> bool:
+        return self.status in (FetchStatus.OK, FetchStatus.STALE)
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Task[RegistryResponse]
+    ticket: Ticket
+    waiters: int = 0
+    # Shared with the fetch, callers come and go while it runs
+    previews: list[PreviewCallback] = field(default_factory=list)
+
+
+# Fetches currently running, by endpoint
+_in_flight: dict[str, _Flight] = {}
+# Endpoints the registry answered with 404, until when we believe it
+_not_found: dict[str, float] = {}
+
+
+def not_found_document(endpoint: str) -> str:
+    """Shown in place of a document the registry doesn't have"""
+    return f"# Not found\n\n`{endpoint}` was not found in the registry."
+
+
+async def get_registry_api(
+    endpoint: str, json: bool = True, priority: Priority = Priority.INTERACTIVE, on_preview: PreviewCallback | None = None
+) -> dict[str, dict] | str:
     """
     Sends GET request to opentofu providers registry to a given endpoint
     and returns the response either as a JSON or as a string. It also "logs" the request.
+    Empty string when the endpoint is unavailable, see `fetch_registry_api` to tell why.
+    """
+    return (await fetch_registry_api(endpoint, json=json, priority=priority, on_preview=on_preview)).content
 
-    Local cache is used to save/retrieve API responses.
+
+async def fetch_registry_api(
+    endpoint: str, json: bool = True, priority: Priority = Priority.INTERACTIVE, on_preview: PreviewCallback | None = None
+) -> RegistryResponse:
     """
-    uri = f"https://api.opentofu.org/registry/docs/providers/{endpoint}"
+    Local cache is used to save/retrieve API responses, only successful responses are cached.
+    Expired entries are revalidated with a conditional request, 304 only refreshes the cached copy.
+    404 is remembered for `NOT_FOUND_TTL`, asking again in the meantime doesn't go to the registry.
+    When the request fails, an expired cached copy is returned if there is one.
+    Concurrent calls for the same endpoint share a single fetch (and a single cache write).
+    The fetch is cancelled only when every caller waiting for it was cancelled.
+    Requests to the registry start by priority (see `tofuref.data.scheduler`), a shared fetch gets the highest one.
+    JSON is decoded with the fastest available decoder (see `tofuref.data.decoding`).
+
+    With `on_preview`, a download is streamed and the callback gets the beginning of the document
+    as soon as `STREAM_PREVIEW_SIZE` of it arrives (only when it's longer), while this caller is still waiting.
+    """
+    flight = _in_flight.get(endpoint)
+    if flight is None:
+        ticket = scheduler.ticket(REGISTRY_HOST, priority)
+        previews = [on_preview] if on_preview else []
+        flight = _Flight(asyncio.create_task(_fetch_registry_api(endpoint, ticket, previews)), ticket, previews=previews)
+        _in_flight[endpoint] = flight
+        flight.task.add_done_callback(partial(_forget_in_flight, endpoint))
+    else:
+        LOGGER.debug(f"Joining in-flight request for {endpoint}")
+        scheduler.promote(flight.ticket, priority)
+        if on_preview:
+            flight.previews.append(on_preview)
+    flight.waiters += 1
+    try:
+        # Shielded, a cancelled caller must not cancel the fetch for the others
+        response = await asyncio.shield(flight.task)
+    finally:
+        flight.waiters -= 1
+        if on_preview in flight.previews:
+            # Not interested anymore, e.g. another resource was selected meanwhile
+            flight.previews.remove(on_preview)
+        if flight.waiters == 0 and not flight.task.done():
+            # Nobody is interested anymore (e.g. superseded speculative prefetch)
+            LOGGER.debug(f"Cancelling request for {endpoint}")
+            _forget_in_flight(endpoint, flight.task)
+            flight.task.cancel()
+    if not response.content or not json:
+        return response
+    return replace(response, content=decode_json(response.content, schema_for(endpoint)))
+
+
+def document_preview(on_preview: PreviewCallback) -> PreviewCallback:
+    """Registry documents start with frontmatter, the preview gets only the markdown after it (once it's complete)"""
+
+    async def preview(beginning: str) -> None:
+        if beginning.startswith("---\n"):
+            _, separator, beginning = beginning[4:].partition("\n---\n")
+            if not separator:
+                return
+        await on_preview(beginning)
+
+    return preview
+
+
+def _forget_in_flight(endpoint: str, task: asyncio.Task) -> None:
+    if endpoint in _in_flight and _in_flight[endpoint].task is task:
+        del _in_flight[endpoint]
+
+
+async def _fetch_registry_api(endpoint: str, ticket: Ticket, previews: list[PreviewCallback]) -> RegistryResponse:
+    uri = f"{REGISTRY_API_URL}{endpoint}"
     if cached_content := await get_from_cache(endpoint):
-        LOGGER.info(f"Using cached file for {endpoint} from {await cached_file_path(endpoint)}")
-        return jsonlib.loads(cached_content) if json else cached_content
+        LOGGER.info(f"Cache hit for {endpoint} ({config.cache_backend})")
+        stats.hits += 1
+        return RegistryResponse(FetchStatus.OK, cached_content)
+    if _recently_not_found(endpoint):
+        LOGGER.info(f"{endpoint} was not found recently, not fetching")
+        stats.not_found_remembered += 1
+        return RegistryResponse(FetchStatus.NOT_FOUND, http_status=httpx.codes.NOT_FOUND)
     LOGGER.info(f"Cache miss for {endpoint}")
-    LOGGER.debug("Starting async client")
-    async with httpx.AsyncClient(headers={"User-Agent": f"tofuref v{__version__}"}) as client:
-        LOGGER.debug("Client started, sending request")
+    stats.misses += 1
+    if connectivity.offline:
+        LOGGER.info(f"Offline, not fetching {endpoint}")
+        return await _get_stale_from_cache(endpoint)
+    revalidation_headers = await get_revalidation_headers(endpoint)
+    if revalidation_headers:
+        stats.expired_refreshes += 1
+    try:
+        async with scheduler.slot(ticket):
+            started = time.perf_counter()
+            if previews:
+                r = await _stream_registry_api(uri, revalidation_headers, previews)
+            else:
+                r = await get_http_client().get(uri, headers=revalidation_headers, timeout=config.http_request_timeout)
+            stats.record_latency(time.perf_counter() - started)
+        LOGGER.debug("Request sent, response received")
+    except Exception as e:
+        LOGGER.error("Something went wrong", exc_info=e)
+        stats.fetch_errors += 1
+        connectivity.record_failure()
+        return await _get_stale_from_cache(endpoint)
+    # Any response means the registry is reachable, even an error
+    connectivity.record_success()
+    return await _handle_response(endpoint, r)
+
+
+async def _stream_registry_api(uri: str, headers: dict[str, str], previews: list[PreviewCallback]) -> httpx.Response:
+    """
+    Reads the response in chunks, previews get the beginning of a successful one as soon as it arrives.
+    The document is cached once it's complete, same as without streaming.
+    """
+    body = bytearray()
+    async with get_http_client().stream("GET", uri, headers=headers, timeout=config.http_request_timeout) as r:
+        previewed = not r.is_success
+        async for chunk in r.aiter_bytes():
+            body.extend(chunk)
+            if not previewed and len(body) >= STREAM_PREVIEW_SIZE:
+                previewed = True
+                # Cut in the middle of a character is dropped, the next preview is the whole document anyway
+                await _show_preview(previews, body.decode(r.charset_encoding or "utf-8", errors="ignore"))
+    # Already decoded, the response must not be decompressed again
+    response_headers = r.headers.copy()
+    for header in ("content-encoding", "content-length", "transfer-encoding"):
+        response_headers.pop(header, None)
+    return httpx.Response(r.status_code, headers=response_headers, content=bytes(body), request=r.request)
+
+
+async def _show_preview(previews: list[PreviewCallback], beginning: str) -> None:
+    for preview in list(previews):
         try:
-            r = await client.get(uri, timeout=config.http_request_timeout)
-            LOGGER.debug("Request sent, response received")
+            await preview(beginning)
         except Exception as e:
-            LOGGER.error("Something went wrong", exc_info=e)
-            return ""
+            # The download matters more than its preview
+            LOGGER.warning("Preview of a downloading document failed", exc_info=e)
+
+
+async def _handle_response(endpoint: str, r: httpx.Response) -> RegistryResponse:
+    if r.status_code == httpx.codes.NOT_MODIFIED:
+        LOGGER.info(f"{endpoint} not modified, refreshing cached file")
+        stats.not_modified += 1
+        await refresh_cache(endpoint, r.headers)
+        return RegistryResponse(FetchStatus.OK, await get_from_cache(endpoint, allow_expired=True) or "", r.status_code)
+
+    if r.status_code == httpx.codes.NOT_FOUND:
+        LOGGER.info(f"{endpoint} not found in the registry")
+        stats.not_found += 1
+        now = time.monotonic()
+        # Expired entries that weren't asked for again would stay forever
+        for expired in [e for e, not_found_until in _not_found.items() if not_found_until <= now]:
+            del _not_found[expired]
+        _not_found[endpoint] = now + NOT_FOUND_TTL
+        return RegistryResponse(FetchStatus.NOT_FOUND, http_status=r.status_code)
+
+    if not r.is_success:
+        LOGGER.warning(f"Registry responded to {endpoint} with {r.status_code}, not caching")
+        stats.fetch_errors += 1
+        return await _get_stale_from_cache(endpoint, r.status_code)
 
     # Saving as text, because we are loading JSON if desired during cache hit
     LOGGER.info(f"Saving {endpoint} to cache")
-    await save_to_cache(endpoint, r.text)
+    await save_to_cache(endpoint, r.text, r.headers)
+    if not config.disable_cache and parse_endpoint(endpoint).kind in DOCUMENT_KINDS:
+        await save_doc_metadata(endpoint, r.text)
+
+    return RegistryResponse(FetchStatus.OK, r.text, r.status_code)
+
+
+def _recently_not_found(endpoint: str) -> bool:
+    not_found_until = _not_found.get(endpoint)
+    if not_found_until is None:
+        return False
+    if time.monotonic() < not_found_until:
+        return True
+    del _not_found[endpoint]
+    return False
+
 
-    return r.json() if json else r.text
+async def _get_stale_from_cache(endpoint: str, http_status: int | None = None) -> RegistryResponse:
+    """An expired copy is still better than nothing"""
+    if stale_content := await get_from_cache(endpoint, allow_expired=True):
+        LOGGER.info(f"Using expired cached file for {endpoint}")
+        stats.stale_served += 1
+        return RegistryResponse(FetchStatus.STALE, stale_content, http_status)
+    return RegistryResponse(FetchStatus.UNAVAILABLE, http_status=http_status)
@@ -1,8 +1,13 @@
 from abc import ABC, abstractmethod
 from typing import Literal
 
+from tofuref.data.bookmarks import Bookmarks
+
 
 class Item(ABC):
+    # Subclasses are slotted, there are thousands of them
+    __slots__ = ()
+
     @property
     @abstractmethod
     def bookmarked(self) -> bool:
@@ -34,5 +39,11 @@ class Item(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    async def clear_from_cache(self) -> None:
+    async def clear_from_cache(self, bookmarks: Bookmarks) -> None:
+        """Purging a whole provider keeps documents of bookmarked resources"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def prefetch(self) -> None:
+        """Fetch what selecting the item is going to need, ahead of time"""
         raise NotImplementedError
@@ -0,0 +1,87 @@
+"""
+Frontmatter of cached documents (title, subcategory, description), one sidecar per provider version.
+
+Recorded when a document is cached, so listing resources doesn't need to read and parse cached documents.
+Sidecars are rewritten whole, so updates are collected in memory and each sidecar is written once by `flush_metadata`
+(when the app or a CLI command is done), instead of once per document.
+"""
+
+import asyncio
+import json
+import logging
+
+import frontmatter
+from anyio import to_thread
+
+from tofuref.data.cache import DOCUMENT_KINDS, get_from_cache, parse_endpoint, save_to_cache
+
+LOGGER = logging.getLogger(__name__)
+
+# Frontmatter key -> sidecar key
+METADATA_FIELDS = {"page_title": "title", "subcategory": "subcategory", "description": "description"}
+
+DocMetadata = dict[str, str]
+
+# Sidecar endpoint -> metadata of documents not written to it yet
+_pending: dict[str, dict[str, DocMetadata]] = {}
+_flush_lock = asyncio.Lock()
+
+
+def metadata_endpoint(organization: str, name: str, version: str) -> str:
+    return f"{organization}/{name}/{version}/metadata.json"
+
+
+def extract_metadata(document: str) -> DocMetadata:
+    try:
+        metadata = frontmatter.loads(document).metadata
+    except Exception as e:
+        LOGGER.warning(f"Couldn't parse frontmatter: {e}")
+        return {}
+    return {key: str(metadata[field]) for field, key in METADATA_FIELDS.items() if metadata.get(field)}
+
+
+async def load_metadata(organization: str, name: str, version: str) -> dict[str, DocMetadata]:
+    """`kind/name` (e.g. `guides/getting_started`) -> metadata of cached documents of a provider version, including unflushed"""
+    endpoint = metadata_endpoint(organization, name, version)
+    return {**await _load_sidecar(endpoint), **_pending.get(endpoint, {})}
+
+
+async def _load_sidecar(endpoint: str) -> dict[str, DocMetadata]:
+    contents = await get_from_cache(endpoint)
+    if not contents:
+        return {}
+    try:
+        return json.loads(contents)
+    except ValueError:
+        return {}
+
+
+def update_metadata(organization: str, name: str, version: str, documents: dict[str, DocMetadata]) -> None:
+    """Queues the metadata for the next `flush_metadata`"""
+    _pending.setdefault(metadata_endpoint(organization, name, version), {}).update(documents)
+
+
+async def flush_metadata() -> None:
+    """Writes all queued metadata, every sidecar is read and written once"""
+    async with _flush_lock:
+        while _pending:
+            endpoint, documents = next(iter(_pending.items()))
+            # Stays visible to `load_metadata` until written, documents cached meanwhile are kept for the next round
+            written = dict(documents)
+            metadata = await _load_sidecar(endpoint)
+            metadata.update(written)
+            await save_to_cache(endpoint, json.dumps(metadata))
+            for key, value in written.items():
+                if documents.get(key) == value:
+                    del documents[key]
+            if not documents:
+                del _pending[endpoint]
+
+
+async def save_doc_metadata(endpoint: str, document: str) -> None:
+    """Records metadata of a freshly cached document"""
+    key = parse_endpoint(endpoint)
+    if key.kind not in DOCUMENT_KINDS:
+        return
+    metadata = await to_thread.run_sync(extract_metadata, document)
+    update_metadata(key.organization, key.name, key.version, {f"{key.kind}/{key.resource}": metadata})
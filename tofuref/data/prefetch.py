@@ -0,0 +1,146 @@
+"""
+Bulk cache warming (`tofuref prefetch`), so that later lookups don't need the network at all.
+
+Already cached documents are skipped, an interrupted prefetch continues where it stopped when run again.
+"""
+
+import asyncio
+import logging
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+
+from tofuref.data.bookmarks import Bookmarks
+from tofuref.data.cache import is_cached
+from tofuref.data.connectivity import connectivity
+from tofuref.data.helpers import get_registry_api
+from tofuref.data.providers import Provider, listed_providers
+from tofuref.data.resources import ResourceType
+from tofuref.data.scheduler import Priority
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PrefetchError(Exception):
+    pass
+
+
+@dataclass
+class PrefetchTarget:
+    provider: Provider
+    versions: list[str]
+
+
+@dataclass
+class PrefetchResult:
+    downloaded: int = 0
+    skipped: int = 0
+    failed: list[str] = field(default_factory=list)
+
+
+async def load_listed_providers() -> dict[str, Provider]:
+    data = await get_registry_api("index.json", priority=Priority.BACKGROUND)
+    if not data:
+        raise PrefetchError("Couldn't fetch the index of providers")
+    return {p.display_name: p for p in listed_providers(data)}
+
+
+async def resolve_targets(
+    names: Iterable[str],
+    bookmarks: bool = False,
+    top: int = 0,
+    versions: int = 1,
+) -> list[PrefetchTarget]:
+    """
+    Args:
+        names: `organization/name`, optionally pinned to a version with `organization/name@v1.2.3`
+        bookmarks: include bookmarked providers
+        top: include N most popular providers
+        versions: how many most recent versions to prefetch, for providers without a pinned version
+    """
+    providers = await load_listed_providers()
+    pinned: dict[str, list[str]] = {}
+    for name in names:
+        display_name, _, version = name.partition("@")
+        if display_name not in providers:
+            raise PrefetchError(f"Provider {display_name} not found")
+        pinned.setdefault(display_name, [])
+        if version:
+            pinned[display_name].append(version if version.startswith("v") else f"v{version}")
+    if bookmarks:
+        saved = Bookmarks()
+        await saved.async_post_init()
+        for display_name in saved.saved["providers"]:
+            if display_name in providers:
+                pinned.setdefault(display_name, [])
+    if top:
+        for provider in sorted(providers.values(), key=lambda p: p.popularity, reverse=True)[:top]:
+            pinned.setdefault(provider.display_name, [])
+
+    targets = []
+    for display_name, pinned_versions in pinned.items():
+        provider = providers[display_name]
+        available = list(provider.versions)
+        for version in pinned_versions:
+            if version not in available:
+                raise PrefetchError(f"Provider {display_name} has no version {version}")
+        targets.append(PrefetchTarget(provider, pinned_versions or available[:versions]))
+    return targets
+
+
+def version_endpoints(provider: Provider, version: str, resource_index: dict) -> list[str]:
+    """Every document of a provider version, index.json itself is expected to be fetched already"""
+    prefix = f"{provider.organization}/{provider.name}/{version}"
+    endpoints = [f"{prefix}/index.md"]
+    for resource_type in ResourceType:
+        endpoints.extend(f"{prefix}/{resource_type.value}s/{doc['name']}.md" for doc in resource_index["docs"][f"{resource_type.value}s"])
+    return endpoints
+
+
+async def prefetch(
+    targets: list[PrefetchTarget],
+    concurrency: int = 8,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> PrefetchResult:
+    """
+    Downloads index.json, overview and all docs for all targets into the cache.
+
+    Args:
+        on_progress: called with (done, total) after every document
+    """
+    result = PrefetchResult()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(endpoint: str, json: bool = False) -> dict | str:
+        async with semaphore:
+            if connectivity.offline:
+                raise PrefetchError("Registry is unreachable")
+            return await get_registry_api(endpoint, json=json, priority=Priority.BACKGROUND)
+
+    indexes = await asyncio.gather(
+        *(fetch(f"{t.provider.organization}/{t.provider.name}/{v}/index.json", json=True) for t in targets for v in t.versions)
+    )
+    endpoints = []
+    for (target, version), index in zip(((t, v) for t in targets for v in t.versions), indexes, strict=True):
+        if not index:
+            result.failed.append(f"{target.provider.display_name} {version}")
+            continue
+        endpoints.extend(version_endpoints(target.provider, version, index))
+
+    missing = [e for e in endpoints if not await is_cached(e)]
+    result.skipped = len(endpoints) - len(missing)
+    done = result.skipped
+    if on_progress:
+        on_progress(done, len(endpoints))
+
+    async def fetch_doc(endpoint: str) -> None:
+        nonlocal done
+        if await fetch(endpoint):
+            result.downloaded += 1
+        else:
+            result.failed.append(endpoint)
+        done += 1
+        if on_progress:
+            on_progress(done, len(endpoints))
+
+    await asyncio.gather(*(fetch_doc(e) for e in missing))
+    return result
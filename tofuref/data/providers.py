@@ -3,29 +3,55 @@ import logging
 import os
 import shutil
 import subprocess
+import sys
 from asyncio import create_subprocess_shell
+from collections.abc import Iterable
 from dataclasses import dataclass, field
-from typing import Literal
+from fnmatch import fnmatchcase
+from typing import ClassVar, Literal, NamedTuple
 
 import frontmatter
 import httpx
 from textual.content import Content
 
-from tofuref import __version__
 from tofuref.config import config
 from tofuref.data import emojis
 from tofuref.data.bookmarks import Bookmarks
-from tofuref.data.cache import clear_from_cache, get_cached_resources
+from tofuref.data.cache import clear_from_cache, clear_many_from_cache, get_cache_usage, get_cached_resources, parse_endpoint
+from tofuref.data.connectivity import get_http_client
+from tofuref.data.eviction import is_bookmarked_document
 from tofuref.data.helpers import (
+    FetchStatus,
+    PreviewCallback,
+    document_preview,
+    fetch_registry_api,
     get_registry_api,
+    not_found_document,
 )
 from tofuref.data.meta import Item
+from tofuref.data.metadata import load_metadata, update_metadata
 from tofuref.data.resources import Resource, ResourceType
+from tofuref.data.scheduler import Priority
 
 LOGGER = logging.getLogger(__name__)
 
 
-@dataclass
+class ResourcesDiff(NamedTuple):
+    added: list[Resource]
+    removed: list[Resource]
+
+
+def diff_resources(previous: Iterable[Resource], current: Iterable[Resource]) -> ResourcesDiff:
+    """Resources (by type and name) only in `current` and only in `previous`"""
+    previous_keys = {(r.type, r.name) for r in previous}
+    current_keys = {(r.type, r.name) for r in current}
+    return ResourcesDiff(
+        added=[r for r in current if (r.type, r.name) not in previous_keys],
+        removed=[r for r in previous if (r.type, r.name) not in current_keys],
+    )
+
+
+@dataclass(slots=True)
 class Provider(Item):
     organization: str
     name: str
@@ -35,36 +61,74 @@ class Provider(Item):
     popularity: int
     _overview: str | None = None
     _active_version: str | None = None
-    versions: list[dict[str, str]] = field(default_factory=list)
+    # Version ids, newest first, see `versions`
+    _versions: tuple[str, ...] | None = None
+    # Versions as listed in the registry index, decoded on first use
+    _raw_versions: list[dict] | None = field(default=None, repr=False)
     fork_of: str | None = None
-    raw_json: dict | None = None
     resources: list[Resource] = field(default_factory=list)
-    datasources: list[Resource] = field(default_factory=list)
-    functions: list[Resource] = field(default_factory=list)
-    guides: list[Resource] = field(default_factory=list)
     bookmarked: bool = False
     cached: bool = False
-    kind: Literal["providers"] = "providers"
+    kind: ClassVar[Literal["providers"]] = "providers"
     _github_stats: dict[str, str] | None = None
+    # Resources and overview of versions loaded before, restored when switching back to them
+    _loaded_versions: dict[str, tuple[list[Resource], str | None]] = field(default_factory=dict)
 
     @classmethod
     def from_json(cls, data: dict) -> "Provider":
+        # Organizations, names and version ids repeat a lot across the registry
         return cls(
-            organization=data["addr"]["namespace"],
-            name=data["addr"]["name"],
+            organization=sys.intern(data["addr"]["namespace"]),
+            name=sys.intern(data["addr"]["name"]),
             description=data["description"],
             fork_count=data["fork_count"],
             blocked=data["is_blocked"],
             popularity=data["popularity"],
-            versions=data["versions"],
-            fork_of=data.get("fork_of", {}).get("display"),
-            raw_json=data,
+            _raw_versions=data["versions"],
+            fork_of=(data.get("fork_of") or {}).get("display"),
         )
 
+    def update_from(self, other: "Provider") -> None:
+        """Takes over registry data from a newer index, keeping local state (loaded resources, active version...)"""
+        self.description = other.description
+        self.fork_count = other.fork_count
+        self.blocked = other.blocked
+        self.popularity = other.popularity
+        self._versions = other._versions
+        self._raw_versions = other._raw_versions
+        self.fork_of = other.fork_of
+
+    @property
+    def versions(self) -> tuple[str, ...]:
+        """Version ids, newest first. Most providers are never opened, so they are decoded only when needed"""
+        if self._versions is None:
+            self._versions = tuple(sys.intern(v["id"]) for v in self._raw_versions or ())
+            self._raw_versions = None
+        return self._versions
+
+    @versions.setter
+    def versions(self, value: tuple[str, ...]) -> None:
+        self._versions = value
+        self._raw_versions = None
+
     @property
     def display_name(self) -> str:
         return f"{self.organization}/{self.name}"
 
+    @property
+    def listed(self) -> bool:
+        """
+        To show up in tofuref, provider must:
+
+        * have version
+        * not be blocked in the registry
+        * not be a fork
+        * not be part of the organizations opentofu or terraform-providers, because those are just duplicates
+        """
+        # Without decoding the versions
+        has_version = bool(self._versions or self._raw_versions)
+        return has_version and not self.blocked and not self.fork_of and self.organization not in ["terraform-providers", "opentofu"]
+
     @property
     def identifying_name(self) -> str:
         return self.display_name
@@ -77,21 +141,34 @@ class Provider(Item):
     @property
     def active_version(self) -> str:
         if self._active_version is None:
-            self._active_version = self.versions[0]["id"]
+            self._active_version = self.versions[0]
         return self._active_version
 
     @active_version.setter
     def active_version(self, value: str) -> None:
+        if value == self.active_version:
+            return
+        if self.resources or self._overview is not None:
+            self._loaded_versions[self.active_version] = (self.resources, self._overview)
         self._active_version = value
-        self.resources = []
-        self._overview = None
+        self.resources, self._overview = self._loaded_versions.pop(value, ([], None))
+
+    def invalidate_resources(self, active: bool = True) -> None:
+        """
+        Forgets resources loaded for other versions (and for the active one, unless `active` is False),
+        their next load reads the index and cached flags again.
+        """
+        self._loaded_versions.clear()
+        if active:
+            self.resources = []
 
     @property
     def endpoint(self) -> str:
         return f"{self.organization}/{self.name}/{self.active_version}/index.md"
 
-    def _endpoint_wildcard_version(self) -> str:
-        return self.endpoint.replace(self.active_version, "*")
+    @property
+    def resources_endpoint(self) -> str:
+        return f"{self.organization}/{self.name}/{self.active_version}/index.json"
 
     @property
     def use_configuration(self) -> str:
@@ -100,45 +177,81 @@ class Provider(Item):
       version = "{self.active_version.lstrip("v")}"
     }}"""
 
-    async def overview(self) -> str:
+    async def overview(self, priority: Priority = Priority.INTERACTIVE, on_preview: PreviewCallback | None = None) -> str:
+        """`on_preview` gets the beginning of a big overview while it's downloading"""
         if self._overview is None:
-            doc_data = await get_registry_api(self.endpoint, json=False)
-            doc = frontmatter.loads(doc_data)
+            preview = document_preview(on_preview) if on_preview else None
+            response = await fetch_registry_api(self.endpoint, json=False, priority=priority, on_preview=preview)
+            if response.status == FetchStatus.NOT_FOUND:
+                return not_found_document(self.endpoint)
+            if not response.content:
+                # Unavailable (offline), try again next time
+                return ""
+            doc = frontmatter.loads(response.content)
             self._overview = doc.content
             self.cached = True
         return self._overview
 
-    async def load_resources(self, bookmarks: Bookmarks) -> None:
-        if self.resources:
-            self.sort_resources()
-        await self.reload_resources(bookmarks)
+    async def prefetch(self) -> None:
+        # Only warm up the cache for the index, parsing it is the job of the real load
+        await asyncio.gather(self.overview(Priority.VISIBLE), get_registry_api(self.resources_endpoint, json=False, priority=Priority.VISIBLE))
+
+    async def load_resources(self, bookmarks: Bookmarks, reuse: Iterable[Resource] = ()) -> None:
+        """
+        Loads resources of the active version, unless they are loaded already (see `invalidate_resources`).
+        Resources of another version given in `reuse` are taken over when the active version has them too.
+        """
+        if not self.resources:
+            await self.reload_resources(bookmarks, reuse)
+            return
+        # The same resources could have been bookmarked or cached under other versions since
+        saved = set(bookmarks.saved["resources"])
+        cached_resources = set(await get_cached_resources(self.organization, self.name, self.active_version))
+        for resource in self.resources:
+            resource.bookmarked = resource.identifying_name in saved
+            resource.cached = f"{resource.type.value}s/{resource.name}" in cached_resources
+        self.sort_resources()
 
-    async def reload_resources(self, bookmarks: Bookmarks) -> None:
+    async def reload_resources(self, bookmarks: Bookmarks, reuse: Iterable[Resource] = ()) -> None:
         self.resources = []
-        resource_data = await get_registry_api(f"{self.organization}/{self.name}/{self.active_version}/index.json")
-        for g in sorted(resource_data["docs"]["guides"], key=lambda x: x["name"]):
-            self.resources.append(Resource(g["name"], self, type=ResourceType.GUIDE))
-        for r in sorted(resource_data["docs"]["resources"], key=lambda x: x["name"]):
-            self.resources.append(Resource(r["name"], self, type=ResourceType.RESOURCE))
-        for d in sorted(resource_data["docs"]["datasources"], key=lambda x: x["name"]):
-            self.resources.append(Resource(d["name"], self, type=ResourceType.DATASOURCE))
-        for f in sorted(resource_data["docs"]["functions"], key=lambda x: x["name"]):
-            self.resources.append(Resource(f["name"], self, type=ResourceType.FUNCTION))
-
-        cached_resources = await get_cached_resources(self.organization, self.name, self.active_version)
+        resource_data = await get_registry_api(self.resources_endpoint)
+        if not resource_data:
+            # Unavailable (offline), nothing to list
+            return
+        reusable = {(r.type, r.name): r for r in reuse}
+        for resource_type, docs in (
+            (ResourceType.GUIDE, resource_data["docs"]["guides"]),
+            (ResourceType.RESOURCE, resource_data["docs"]["resources"]),
+            (ResourceType.DATASOURCE, resource_data["docs"]["datasources"]),
+            (ResourceType.FUNCTION, resource_data["docs"]["functions"]),
+        ):
+            for doc in sorted(docs, key=lambda x: x["name"]):
+                resource = reusable.get((resource_type, doc["name"]))
+                self.resources.append(resource or Resource(sys.intern(doc["name"]), self, type=resource_type))
+
+        cached_resources, metadata = await asyncio.gather(
+            get_cached_resources(self.organization, self.name, self.active_version),
+            load_metadata(self.organization, self.name, self.active_version),
+        )
+        cached_resources = set(cached_resources)
         preload_content = []
         for resource in self.resources:
-            if bookmarks.check("resources", resource.identifying_name):
-                resource.bookmarked = True
-            if f"{resource.type.value}s/{resource.name}" in cached_resources:
-                resource.cached = True
+            resource.bookmarked = bookmarks.check("resources", resource.identifying_name)
+            resource.cached = f"{resource.type.value}s/{resource.name}" in cached_resources
             if resource.cached and resource.type == ResourceType.GUIDE:
                 # Guide titles should override names taken from the filename
                 # But we don't want to cache all of them just to get the titles
-                # so we load them only if they are cached
-                preload_content.append(resource.content())
+                # so we use them only if they are cached, from the metadata sidecar written along with the document
+                if title := metadata.get(f"guides/{resource.name}", {}).get("title"):
+                    resource._title = title
+                else:
+                    preload_content.append(resource)
 
-        await asyncio.gather(*preload_content)
+        if preload_content:
+            # Cached before the sidecar existed, load them once and remember the titles
+            await asyncio.gather(*(resource.content(Priority.VISIBLE) for resource in preload_content))
+            titles = {f"guides/{r.name}": {"title": r._title} for r in preload_content if r._title is not None}
+            update_metadata(self.organization, self.name, self.active_version, titles)
 
         self.sort_resources()
 
@@ -158,18 +271,32 @@ class Provider(Item):
             prefix = ""
         return Content.from_markup(f"{prefix}[dim italic]{self.organization}[/]/{self.name}")
 
-    async def clear_from_cache(self) -> None:
+    async def clear_from_cache(self, bookmarks: Bookmarks) -> None:
         if self.cached:
-            await clear_from_cache(self._endpoint_wildcard_version())
-            # Also delete overview
-            await clear_from_cache(self._endpoint_wildcard_version().replace(".md", ".json"))
+            pattern = f"{self.organization}/{self.name}/*"
+            if any(bookmark.startswith(f"{self.name}_") for bookmark in bookmarks.saved["resources"]):
+                # Documents of bookmarked resources stay, in every version
+                endpoints = [
+                    entry.endpoint
+                    for entry in await get_cache_usage()
+                    if fnmatchcase(entry.endpoint, pattern) and not is_bookmarked_document(parse_endpoint(entry.endpoint), bookmarks)
+                ]
+                await clear_many_from_cache(endpoints)
+            else:
+                # Every version (index, overview and documents) in a single pass
+                await clear_from_cache(pattern)
             self.cached = False
+            for resource in self.resources:
+                resource.cached = resource.cached and resource.bookmarked
+            for resources, _ in self._loaded_versions.values():
+                for resource in resources:
+                    resource.cached = resource.cached and resource.bookmarked
 
     async def github_stats(self):
         # Not the prettiest, but all the http requests and cache handling should be refactored soon
         if self._github_stats:
             return self._github_stats
-        headers = {"User-Agent": f"tofuref v{__version__}", "X-GitHub-Api-Version": "2022-11-28", "Accept": "application/vnd.github+json"}
+        headers = {"X-GitHub-Api-Version": "2022-11-28", "Accept": "application/vnd.github+json"}
         if os.getenv("GITHUB_TOKEN"):
             LOGGER.info("GitHub token found in env")
             headers["Authorization"] = f"Bearer {os.getenv('GITHUB_TOKEN')}"
@@ -182,13 +309,14 @@ class Provider(Item):
                 LOGGER.info("Using gh to get GitHub token")
                 headers["Authorization"] = f"Bearer {token}"
 
-        async with httpx.AsyncClient(headers=headers) as client:
-            try:
-                ret = await client.get(
-                    f"https://api.github.com/repos/{self.organization}/terraform-provider-{self.name}", timeout=config.http_request_timeout
-                )
-            except httpx.HTTPError as _:
-                return self._github_stats
+        try:
+            ret = await get_http_client().get(
+                f"https://api.github.com/repos/{self.organization}/terraform-provider-{self.name}",
+                headers=headers,
+                timeout=config.http_request_timeout,
+            )
+        except httpx.HTTPError as _:
+            return self._github_stats
         data = ret.json()
 
         ok_status_code = 200
@@ -207,3 +335,9 @@ class Provider(Item):
 
             self._github_stats = stats
         return self._github_stats
+
+
+def listed_providers(data: dict) -> list[Provider]:
+    """Providers from the registry index that show up in tofuref (see `Provider.listed`), in the order of the index"""
+    providers = (Provider.from_json(p) for p in data["providers"])
+    return [p for p in providers if p.listed]
@@ -1,17 +1,24 @@
 from dataclasses import dataclass
 from enum import Enum
-from typing import TYPE_CHECKING, Literal
+from typing import TYPE_CHECKING, ClassVar, Literal
 
 import frontmatter
 from textual.content import Content
 
 from tofuref.config import config
 from tofuref.data import emojis
+from tofuref.data.bookmarks import Bookmarks
 from tofuref.data.cache import clear_from_cache
 from tofuref.data.helpers import (
+    FetchStatus,
+    PreviewCallback,
+    document_preview,
+    fetch_registry_api,
     get_registry_api,
+    not_found_document,
 )
 from tofuref.data.meta import Item
+from tofuref.data.scheduler import Priority
 
 if TYPE_CHECKING:
     from tofuref.data.providers import Provider
@@ -24,16 +31,18 @@ class ResourceType(Enum):
     FUNCTION = "function"
 
 
-@dataclass
+@dataclass(slots=True)
 class Resource(Item):
     name: str
     provider: "Provider"
     type: ResourceType
     _content: str | None = None
+    # Resources are shared by versions of the provider that have them, content belongs to one of them
+    _content_version: str | None = None
     cached: bool = False
     _title: str | None = None
     bookmarked: bool = False
-    kind: Literal["resources"] = "resources"
+    kind: ClassVar[Literal["resources"]] = "resources"
 
     def __lt__(self, other: "Resource") -> bool:
         return self.name < other.name
@@ -68,18 +77,30 @@ class Resource(Item):
     def endpoint(self) -> str:
         return f"{self.provider.organization}/{self.provider.name}/{self.provider.active_version}/{self.type.value}s/{self.name}.md"
 
-    async def content(self):
-        if self._content is None:
-            doc_data = await get_registry_api(self.endpoint, json=False)
-            doc = frontmatter.loads(doc_data)
+    async def content(self, priority: Priority = Priority.INTERACTIVE, on_preview: PreviewCallback | None = None):
+        """`on_preview` gets the beginning of a big document while it's downloading"""
+        if self._content is None or self._content_version != self.provider.active_version:
+            version = self.provider.active_version
+            preview = document_preview(on_preview) if on_preview else None
+            response = await fetch_registry_api(self.endpoint, json=False, priority=priority, on_preview=preview)
+            if response.status == FetchStatus.NOT_FOUND:
+                return not_found_document(self.endpoint)
+            if not response.content:
+                # Unavailable (offline), try again next time
+                return ""
+            doc = frontmatter.loads(response.content)
             self._content = doc.content
+            self._content_version = version
             if self.type == ResourceType.GUIDE:
                 # noinspection PyTypeChecker
                 self._title = doc.metadata["page_title"]
             self.cached = True
         return self._content
 
-    async def clear_from_cache(self) -> None:
+    async def prefetch(self) -> None:
+        await self.content(Priority.VISIBLE)
+
+    async def clear_from_cache(self, bookmarks: Bookmarks) -> None:
         # TODO clear all versions?
         if self.cached:
             await clear_from_cache(self.endpoint)
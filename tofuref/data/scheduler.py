@@ -0,0 +1,122 @@
+"""
+Admission of registry requests, so background work can't delay what the user is waiting for.
+
+Every request that goes to the network takes a slot first. The number of requests running at once is capped
+(`max_concurrent_fetches` overall, `max_fetches_per_host` per host) and waiting requests start by priority.
+Only interactive requests may take the last slot, so prefetching never fills the pool in front of a selection.
+"""
+
+import asyncio
+import itertools
+import logging
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+
+from tofuref.config import config
+
+LOGGER = logging.getLogger(__name__)
+
+# Slots kept free for interactive requests
+INTERACTIVE_RESERVE = 1
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    """Explicit selection, the user is waiting for it"""
+    VISIBLE = 1
+    """Speculative prefetch of the highlighted item, titles of listed guides"""
+    BACKGROUND = 2
+    """Warming up the cache (`tofuref prefetch`)"""
+
+
+@dataclass(eq=False)
+class Ticket:
+    host: str
+    priority: Priority
+    order: int
+    granted: asyncio.Future[None] = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    # Generation of the scheduler the slot was granted in, see `FetchScheduler.reset`
+    generation: int | None = None
+
+
+class FetchScheduler:
+    def __init__(self) -> None:
+        self.running = 0
+        self.running_by_host: Counter[str] = Counter()
+        self._waiting: list[Ticket] = []
+        self._order = itertools.count()
+        self._generation = 0
+
+    def ticket(self, host: str, priority: Priority) -> Ticket:
+        return Ticket(host, priority, next(self._order))
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    @asynccontextmanager
+    async def slot(self, ticket: Ticket) -> AsyncIterator[None]:
+        """Waits until the request may start, the slot is held until the block is left"""
+        self._waiting.append(ticket)
+        self._dispatch()
+        if not ticket.granted.done():
+            LOGGER.debug(f"Request to {ticket.host} queued ({ticket.priority.name}), {self.running} running")
+        try:
+            await ticket.granted
+        except asyncio.CancelledError:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            elif ticket.granted.done() and not ticket.granted.cancelled():
+                # Granted in the same loop iteration as the cancellation
+                self._release(ticket)
+            raise
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    def promote(self, ticket: Ticket, priority: Priority) -> None:
+        """Someone more important is waiting for the same request"""
+        if priority < ticket.priority:
+            ticket.priority = priority
+            self._dispatch()
+
+    def _release(self, ticket: Ticket) -> None:
+        # Slots granted before a reset aren't counted anymore
+        if ticket.generation == self._generation:
+            self.running -= 1
+            self.running_by_host[ticket.host] -= 1
+        self._dispatch()
+
+    def _can_start(self, ticket: Ticket) -> bool:
+        reserve = 0 if ticket.priority == Priority.INTERACTIVE else INTERACTIVE_RESERVE
+        limit = max(1, config.max_concurrent_fetches - reserve)
+        host_limit = max(1, config.max_fetches_per_host - reserve)
+        return self.running < limit and self.running_by_host[ticket.host] < host_limit
+
+    def _dispatch(self) -> None:
+        for ticket in sorted(self._waiting, key=lambda t: (t.priority, t.order)):
+            if self._can_start(ticket):
+                self._waiting.remove(ticket)
+                self.running += 1
+                self.running_by_host[ticket.host] += 1
+                ticket.generation = self._generation
+                ticket.granted.set_result(None)
+
+    def reset(self) -> None:
+        """
+        Cancels waiting requests and forgets running ones, when the app (and its event loop) is done.
+        Requests that were running may never release their slot, those that still do are ignored.
+        """
+        self._generation += 1
+        for ticket in self._waiting:
+            ticket.granted.cancel()
+        self._waiting.clear()
+        self.running = 0
+        self.running_by_host.clear()
+
+
+scheduler = FetchScheduler()
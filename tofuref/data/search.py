@@ -0,0 +1,68 @@
+"""
+Search over many items (all providers of the registry) that doesn't score every one of them on every keystroke.
+
+An inverted index of characters and trigrams narrows the candidates of a query, only those are matched.
+The candidates are a superset of the matches, so results are the same as matching every item.
+"""
+
+from collections.abc import Mapping
+from typing import Generic, TypeVar
+
+from textual.fuzzy import Matcher
+
+T = TypeVar("T")
+
+TRIGRAM = 3
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i : i + TRIGRAM] for i in range(len(text) - TRIGRAM + 1)}
+
+
+class SearchIndex(Generic[T]):
+    def __init__(self, items: Mapping[str, T]) -> None:
+        self.keys = list(items)
+        self.values = list(items.values())
+        self._characters: dict[str, set[int]] = {}
+        self._trigrams: dict[str, set[int]] = {}
+        for position, key in enumerate(self.keys):
+            lowered = key.lower()
+            for character in set(lowered):
+                self._characters.setdefault(character, set()).add(position)
+            for trigram in _trigrams(lowered):
+                self._trigrams.setdefault(trigram, set()).add(position)
+        # Matches of the previous query, typing on narrows them further
+        self._last: tuple[str, bool, list[int]] | None = None
+
+    def _candidates(self, query: str, fuzzy: bool) -> list[int]:
+        """Positions of items that can match, in the original order"""
+        # Fuzzy matching ignores case, plain matching doesn't
+        normalized = query.lower() if fuzzy else query
+        if self._last is not None and self._last[1] == fuzzy and self._last[0] in normalized:
+            # Whatever matches the longer query, matched the previous one too
+            return self._last[2]
+        lowered = query.lower()
+        if fuzzy or len(lowered) < TRIGRAM:
+            postings = [self._characters.get(character, set()) for character in set(lowered)]
+        else:
+            postings = [self._trigrams.get(trigram, set()) for trigram in _trigrams(lowered)]
+        if not postings:
+            return list(range(len(self.keys)))
+        postings.sort(key=len)
+        return sorted(postings[0].intersection(*postings[1:]))
+
+    def search(self, query: str, fuzzy: bool) -> list[T]:
+        """
+        Fuzzy search returns the best matches first (see `textual.fuzzy.Matcher`),
+        otherwise items containing the query in their key are returned in the original order.
+        """
+        candidates = self._candidates(query, fuzzy)
+        if fuzzy:
+            matcher = Matcher(query)
+            scored = [(position, matcher.match(self.keys[position])) for position in candidates]
+            matches = [position for position, score in scored if score > 0]
+            ranked = [position for position, score in sorted(scored, key=lambda x: x[1], reverse=True) if score > 0]
+        else:
+            matches = ranked = [position for position in candidates if query in self.keys[position]]
+        self._last = (query.lower() if fuzzy else query, fuzzy, matches)
+        return [self.values[position] for position in ranked]
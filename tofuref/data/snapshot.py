@@ -0,0 +1,74 @@
+"""
+Precomputed table of listed providers, so that startup doesn't need to parse and filter the whole registry index.
+
+Stored with `marshal` next to the cached index and tied to its identity (when it was fetched and its ETag),
+any change of the index (download, revalidation) makes the snapshot stale.
+"""
+
+import logging
+import marshal
+from collections.abc import Iterable
+from pathlib import Path
+
+from anyio import to_thread
+
+from tofuref.config import config
+from tofuref.data.cache import get_backend, get_cache_path, load_validators, write_cache_file
+from tofuref.data.providers import Provider
+
+LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = "index.snapshot"
+# Bump when Provider fields or listing rules change
+SNAPSHOT_FORMAT = 2
+
+
+async def _index_identity() -> tuple | None:
+    fetched_at = await get_backend().fetched_at("index.json")
+    if fetched_at is None:
+        return None
+    return SNAPSHOT_FORMAT, fetched_at, (await load_validators("index.json")).get("etag")
+
+
+async def load_provider_snapshot() -> list[Provider] | None:
+    """Listed providers in the order of the index, None if there is no snapshot for the current cached index"""
+    if config.disable_cache:
+        return None
+    identity = await _index_identity()
+    if identity is None:
+        return None
+
+    def load() -> tuple | None:
+        try:
+            return marshal.loads((Path(get_cache_path()) / SNAPSHOT_FILENAME).read_bytes())
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+
+    snapshot = await to_thread.run_sync(load)
+    if not snapshot or snapshot[0] != identity:
+        LOGGER.debug("No usable provider snapshot")
+        return None
+    return [
+        Provider(
+            organization=organization,
+            name=name,
+            description=description,
+            fork_count=fork_count,
+            blocked=False,
+            popularity=popularity,
+            _versions=versions,
+        )
+        for organization, name, description, fork_count, popularity, versions in snapshot[1]
+    ]
+
+
+async def save_provider_snapshot(providers: Iterable[Provider]) -> None:
+    """Providers must be the listed ones (see `Provider.listed`), built from the currently cached index"""
+    if config.disable_cache:
+        return
+    identity = await _index_identity()
+    if identity is None:
+        return
+    table = tuple((p.organization, p.name, p.description, p.fork_count, p.popularity, p.versions) for p in providers)
+
+    await to_thread.run_sync(write_cache_file, SNAPSHOT_FILENAME, marshal.dumps((identity, table)))
@@ -0,0 +1,101 @@
+"""
+Counters of cache and registry traffic, for the current session and accumulated over all sessions.
+
+Session counters are logged when tofuref exits and merged into `stats.json` in the cache directory,
+`tofuref cache stats` shows the accumulated ones.
+"""
+
+import json
+import logging
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+
+LOGGER = logging.getLogger(__name__)
+
+STATS_FILENAME = "stats.json"
+# Upper bounds of fetch latency histogram buckets, the last bucket is everything slower
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500)
+
+
+def _empty_histogram() -> list[int]:
+    return [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stale_served: int = 0
+    not_modified: int = 0
+    expired_refreshes: int = 0
+    fetch_errors: int = 0
+    not_found: int = 0
+    # Not found answered from memory, without asking the registry again
+    not_found_remembered: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    fetch_latency_ms: list[int] = field(default_factory=_empty_histogram)
+
+    def record_latency(self, seconds: float) -> None:
+        milliseconds = seconds * 1000
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if milliseconds < bound), len(LATENCY_BUCKETS_MS))
+        self.fetch_latency_ms[bucket] += 1
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def merge(self, other: "CacheStats") -> None:
+        for f in fields(self):
+            if f.name == "fetch_latency_ms":
+                self.fetch_latency_ms = [a + b for a, b in zip(self.fetch_latency_ms, other.fetch_latency_ms, strict=True)]
+            else:
+                setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+    def reset(self) -> None:
+        for f in fields(self):
+            setattr(self, f.name, getattr(CacheStats(), f.name))
+
+    def latency_histogram(self) -> dict[str, int]:
+        labels = [f"<{bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">={LATENCY_BUCKETS_MS[-1]}ms"]
+        return dict(zip(labels, self.fetch_latency_ms, strict=True))
+
+    def summary(self) -> str:
+        return (
+            f"hits {self.hits}, misses {self.misses} ({self.hit_ratio:.0%} hit ratio), stale served {self.stale_served}, "
+            f"not modified {self.not_modified}, expired refreshes {self.expired_refreshes}, fetch errors {self.fetch_errors}, "
+            f"not found {self.not_found} (remembered {self.not_found_remembered}), read {self.bytes_read} B, written {self.bytes_written} B, "
+            f"fetch latency {self.latency_histogram()}"
+        )
+
+
+# Current session
+stats = CacheStats()
+
+
+def load_stats(cache_path: Path) -> CacheStats:
+    """Counters accumulated over all sessions"""
+    try:
+        data = json.loads((cache_path / STATS_FILENAME).read_text())
+        loaded = CacheStats(**data)
+    except (OSError, ValueError, TypeError):
+        return CacheStats()
+    if len(loaded.fetch_latency_ms) != len(LATENCY_BUCKETS_MS) + 1:
+        # Buckets changed, histogram can't be merged
+        loaded.fetch_latency_ms = _empty_histogram()
+    return loaded
+
+
+def merge_session_stats(cache_path: Path) -> bytes | None:
+    """
+    Session counters merged into the accumulated ones, serialized for saving into the cache directory.
+    Counting of the session starts from zero again. None if nothing happened.
+    """
+    if stats == CacheStats():
+        return None
+    LOGGER.info(f"Cache stats of this session: {stats.summary()}")
+    accumulated = load_stats(cache_path)
+    accumulated.merge(stats)
+    stats.reset()
+    return json.dumps(asdict(accumulated)).encode()
@@ -3,10 +3,11 @@ import locale
 import logging
 import sys
 import time
+from collections.abc import Coroutine
+from pathlib import Path
 from typing import ClassVar
 
 import click
-import httpx
 from packaging.version import Version
 from textual import on
 from textual.app import App, ComposeResult
@@ -22,11 +23,32 @@ from textual.widgets import (
     TabbedContent,
     TabPane,
 )
+from textual.worker import Worker
 
 from tofuref import __version__
 from tofuref.config import config
 from tofuref.data.bookmarks import Bookmarks
+from tofuref.data.bundle import BundleError, BundleResult, export_bundle, import_bundle
+from tofuref.data.cache import (
+    CacheEntry,
+    CacheProblem,
+    clear_from_cache,
+    close_cache,
+    get_cache_path,
+    get_cache_usage,
+    total_size,
+    usage_by_version,
+    verify_cache,
+)
+from tofuref.data.connectivity import close_http_client, connectivity, get_http_client
+from tofuref.data.eviction import evict
+from tofuref.data.metadata import flush_metadata
+from tofuref.data.prefetch import PrefetchError, PrefetchResult, prefetch, resolve_targets
+from tofuref.data.providers import Provider
 from tofuref.data.resources import ResourceType
+from tofuref.data.scheduler import scheduler
+from tofuref.data.search import SearchIndex
+from tofuref.data.stats import CacheStats, load_stats, stats
 from tofuref.startup import StartupTarget, find_best_provider
 from tofuref.widgets import (
     CodeBlockSelect,
@@ -40,6 +62,11 @@ from tofuref.widgets import (
 )
 
 LOGGER = logging.getLogger(__name__)
+
+# Seconds after the initial load and between background cache evictions
+EVICTION_DELAY = 10
+EVICTION_INTERVAL = 600
+
 locale.setlocale(locale.LC_ALL, "")
 
 
@@ -111,7 +138,7 @@ class TofuRefApp(App):
 
         # Internal state
         self.bookmarks = Bookmarks()
-        self.providers = {}
+        self.providers: dict[str, Provider] = {}
         self._active_provider = None
         self._active_resource = None
         self._search_target: ProvidersOptionList | ResourcesOptionList | None = None
@@ -119,6 +146,16 @@ class TofuRefApp(App):
         self.theme = config.theme.ui
         self.__load_time: float | None = None
 
+    @property
+    def providers(self) -> dict[str, Provider]:
+        return self._providers
+
+    @providers.setter
+    def providers(self, providers: dict[str, Provider]) -> None:
+        """Providers are only ever replaced as a whole (also when re-sorted), so the search index is built here"""
+        self._providers = providers
+        self.provider_index = SearchIndex(providers)
+
     @property
     def active_provider(self):
         return self._active_provider
@@ -163,6 +200,29 @@ class TofuRefApp(App):
 
         yield Footer()
 
+    def on_mount(self) -> None:
+        connectivity.add_listener(self.on_connectivity_changed)
+
+    async def on_unmount(self) -> None:
+        connectivity.remove_listener(self.on_connectivity_changed)
+        connectivity.reset()
+        scheduler.reset()
+        # The app owns the shared client, make sure pooled connections don't outlive it
+        await close_http_client()
+        await flush_metadata()
+        close_cache()
+
+    def on_connectivity_changed(self, offline: bool) -> None:
+        self.query_one(Status).set_offline(offline)
+        if offline:
+            self.notify(
+                "Registry is unreachable, showing only cached documents until it's back.",
+                title="Offline mode",
+                severity="warning",
+            )
+        else:
+            self.notify("Registry is reachable again.", title="Back online")
+
     async def on_ready(self) -> None:
         # Draw the initial layout
         await self.force_draw(initial=True)
@@ -176,10 +236,28 @@ class TofuRefApp(App):
         self.navigation_providers.populate()
         await self.rearrange_loaded()
         await self.force_draw(initial=True)
+        if self.navigation_providers.index_expired:
+            self.run_worker(self.navigation_providers.refresh_index(), name="refresh index", exit_on_error=False)
+        if not config.disable_cache:
+            # Not competing with the first interactions
+            self.set_timer(EVICTION_DELAY, self.schedule_eviction)
+            self.set_interval(EVICTION_INTERVAL, self.schedule_eviction)
         if config.show_load_times:
             self.__load_time = time.perf_counter() - self.__start_time
             self.notify(f"Loaded in {int(self.__load_time * 1000)}ms", timeout=10)
 
+    def schedule_eviction(self) -> None:
+        self.run_worker(self.evict_from_cache(), name="cache eviction", group="cache-eviction", exclusive=True, exit_on_error=False)
+
+    async def evict_from_cache(self) -> None:
+        result = await evict(self.bookmarks)
+        if result.evicted:
+            LOGGER.info(f"Cache is {result.total_bytes} bytes after evicting {result.evicted} entries")
+            # Cached flags of resources loaded earlier could be stale now, only the displayed ones are kept
+            for provider in self.providers.values():
+                provider.invalidate_resources(active=provider is not self.active_provider)
+        LOGGER.info(f"Cache stats: {stats.summary()}")
+
     async def load_providers_and_bookmarks(self) -> None:
         to_load = [self.navigation_providers.load_index(), self.bookmarks.async_post_init()]
         self.providers, _ = await asyncio.gather(*to_load)
@@ -307,7 +385,7 @@ class TofuRefApp(App):
             await resources_tab.remove_children("#version-select")
         else:
             version_select = Select.from_values(
-                (v["id"] for v in self.active_provider.versions),
+                self.active_provider.versions,
                 prompt="Select Provider Version",
                 allow_blank=False,
                 value=self.active_provider.active_version,
@@ -319,17 +397,31 @@ class TofuRefApp(App):
             version_select.action_show_overlay()
 
     @on(Select.Changed, "#version-select")
-    async def change_provider_version(self, event: Select.Changed) -> None:
+    def change_provider_version(self, event: Select.Changed) -> None:
         if event.value != self.active_provider.active_version:
-            previous = self.navigation_resources.highlighted_option.prompt if self.navigation_resources.highlighted is not None else None
-            self.active_provider.active_version = event.value
-            self.query_one("Status").version.content = event.value
-            await self.navigation_resources.load_provider_resources(self.active_provider)
-            if previous:
-                for idx, option in enumerate(self.navigation_resources.options):
-                    if option.prompt.name == previous.name and option.prompt.type == previous.type:
-                        self.navigation_resources.highlighted = idx
-                        break
+            self.load_selection(self._switch_provider_version(event.value), f"version {event.value}", provider=True)
+
+    async def _switch_provider_version(self, version: str) -> None:
+        previous = self.navigation_resources.highlighted_option.prompt if self.navigation_resources.highlighted is not None else None
+        previous_version, previous_resources = self.active_provider.active_version, self.active_provider.resources
+        self.active_provider.active_version = version
+        self.query_one("Status").version.content = version
+        await self.navigation_resources.load_provider_version(self.active_provider, previous_resources, previous_version)
+        if previous:
+            for idx, option in enumerate(self.navigation_resources.options):
+                if option.prompt.name == previous.name and option.prompt.type == previous.type:
+                    self.navigation_resources.highlighted = idx
+                    break
+
+    def load_selection(self, load: Coroutine, name: str, provider: bool = False) -> Worker:
+        """
+        Selected provider (or its version) and resource load in a worker, latest selection wins.
+        Selecting another one cancels the previous load (its fetch, parsing and rendering),
+        selecting a provider cancels loading of a resource too.
+        """
+        if provider:
+            self.workers.cancel_group(self, "load-resource")
+        return self.run_worker(load, name=f"load {name}", group="load-provider" if provider else "load-resource", exclusive=True)
 
     async def _on_version_select_expanded(self, expanded: bool) -> None:
         if not expanded:
@@ -343,12 +435,8 @@ class TofuRefApp(App):
         if search_target == self.navigation_providers:
             if not query:
                 self.navigation_providers.populate()
-            elif config.fuzzy_search:
-                matcher = Matcher(query)
-                scored = [(v, matcher.match(p)) for p, v in self.providers.items()]
-                self.navigation_providers.populate([v for v, s in sorted(scored, key=lambda x: x[1], reverse=True) if s > 0])
             else:
-                self.navigation_providers.populate([v for p, v in self.providers.items() if query in p])
+                self.navigation_providers.populate(self.provider_index.search(query, fuzzy=config.fuzzy_search))
         elif search_target == self.navigation_resources and self.active_provider:
             if not query:
                 self.navigation_resources.populate(
@@ -356,7 +444,7 @@ class TofuRefApp(App):
                 )
             elif config.fuzzy_search:
                 matcher = Matcher(query)
-                all_items = self.active_provider.resources + self.active_provider.datasources
+                all_items = self.active_provider.resources
                 scored = [(r, matcher.match(r.name)) for r in all_items]
                 self.navigation_resources.populate(
                     self.active_provider,
@@ -365,7 +453,7 @@ class TofuRefApp(App):
             else:
                 self.navigation_resources.populate(
                     self.active_provider,
-                    [r for r in (self.active_provider.resources + self.active_provider.datasources) if query in r.name],
+                    [r for r in self.active_provider.resources if query in r.name],
                 )
 
     @on(Input.Submitted, "#search")
@@ -379,7 +467,11 @@ class TofuRefApp(App):
 
     @on(OptionList.OptionSelected)
     async def option_list_option_selected(self, event: OptionList.OptionSelected) -> None:
-        await event.control.on_option_selected(event.option)
+        if isinstance(event.control, ProvidersOptionList | ResourcesOptionList):
+            provider = isinstance(event.control, ProvidersOptionList)
+            self.load_selection(event.control.on_option_selected(event.option), event.option.prompt.display_name, provider=provider)
+        else:
+            await event.control.on_option_selected(event.option)
 
     async def _navigate_to_provider(self, provider_name: str) -> None:
         provider_name = provider_name.lower()
@@ -417,16 +509,173 @@ class TofuRefApp(App):
 
 
 async def get_current_pypi_version() -> Version:
-    async with httpx.AsyncClient(headers={"User-Agent": f"tofuref v{__version__}"}) as client:
+    try:
+        r = await get_http_client().get("https://pypi.org/pypi/tofuref/json", timeout=config.http_request_timeout)
+    except Exception as _:
+        return Version("0.0.0")
+    return Version(r.json()["info"]["version"])
+
+
+def _cache_stats_report(accumulated: CacheStats, total: int, usage: dict[tuple[str, str], int], top: int) -> list[str]:
+    largest = sorted(usage.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [
+        f"Backend: {config.cache_backend}, {total:n} bytes in {len(usage):n} provider versions and indexes",
+        f"Hits {accumulated.hits:n}, misses {accumulated.misses:n} ({accumulated.hit_ratio:.0%} hit ratio)",
+        f"Stale served {accumulated.stale_served:n}, not modified {accumulated.not_modified:n}, "
+        f"expired refreshes {accumulated.expired_refreshes:n}, fetch errors {accumulated.fetch_errors:n}, "
+        f"not found {accumulated.not_found:n} (remembered {accumulated.not_found_remembered:n})",
+        f"Read {accumulated.bytes_read:n} bytes, written {accumulated.bytes_written:n} bytes",
+        "Fetch latency:",
+        *(f"  {bucket:>9} {count:n}" for bucket, count in accumulated.latency_histogram().items()),
+        "Largest:",
+        *(f"  {provider} {version}".rstrip() + f": {size:n} bytes" for (provider, version), size in largest),
+    ]
+
+
+@click.group("cache")
+def cache_cmd() -> None:
+    """Inspects the local cache"""
+
+
+@cache_cmd.command("stats")
+@click.option("-n", "--top", type=int, default=10, show_default=True, help="How many largest provider versions to list")
+def cache_stats_cmd(top: int) -> None:
+    """Shows cache counters accumulated over all sessions and the size of cached provider versions"""
+
+    async def run() -> list[CacheEntry]:
         try:
-            r = await client.get("https://pypi.org/pypi/tofuref/json", timeout=config.http_request_timeout)
-        except Exception as _:
-            return Version("0.0.0")
-        return Version(r.json()["info"]["version"])
+            return await get_cache_usage()
+        finally:
+            close_cache()
+
+    entries = asyncio.run(run())
+    click.echo("\n".join(_cache_stats_report(load_stats(Path(get_cache_path())), total_size(entries), usage_by_version(entries), top)))
+
+
+@cache_cmd.command("verify")
+@click.option("--fix", is_flag=True, help="Delete broken entries, they get downloaded again when needed")
+def cache_verify_cmd(fix: bool) -> None:
+    """Checks every cache entry for missing or empty bodies, broken compression and invalid JSON"""
+
+    async def run() -> list[CacheProblem]:
+        try:
+            found = await verify_cache()
+            if fix:
+                for problem in found:
+                    await clear_from_cache(problem.endpoint)
+            return found
+        finally:
+            close_cache()
+
+    problems = asyncio.run(run())
+    for problem in problems:
+        click.echo(f"{problem.endpoint}: {problem.problem}", err=True)
+    click.echo(f"Found {len(problems):n} broken entries" + (", deleted" if fix and problems else ""))
+    if problems and not fix:
+        sys.exit(1)
+
+
+@cache_cmd.command("export")
+@click.argument("bundle", type=click.Path(dir_okay=False, writable=True, path_type=Path))
+@click.argument("providers", nargs=-1)
+def cache_export_cmd(bundle: Path, providers: tuple[str, ...]) -> None:
+    """
+    Packs the cache into BUNDLE (a .tar.gz), for hosts without access to the registry.
+
+    Only PROVIDERS ('organization/name' or 'organization/name@version') are included when given,
+    the provider index always is. Download what's missing with 'tofuref prefetch' first.
+    """
+
+    async def run() -> BundleResult:
+        try:
+            return await export_bundle(bundle, providers)
+        finally:
+            close_cache()
+
+    try:
+        result = asyncio.run(run())
+    except BundleError as e:
+        raise click.ClickException(str(e)) from e
+    click.echo(f"Exported {result.entries:n} entries ({result.size:n} bytes) into {bundle}")
+    for skipped in result.skipped:
+        click.echo(f"  unreadable, not exported: {skipped}", err=True)
+
+
+@cache_cmd.command("import")
+@click.argument("bundle", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+def cache_import_cmd(bundle: Path) -> None:
+    """
+    Loads BUNDLE created by 'tofuref cache export' into the cache.
+
+    Every entry is checked against the checksums in the bundle before anything is imported.
+    Entries that are already cached are kept.
+    """
+
+    async def run() -> BundleResult:
+        try:
+            return await import_bundle(bundle)
+        finally:
+            close_cache()
+
+    try:
+        result = asyncio.run(run())
+    except BundleError as e:
+        raise click.ClickException(str(e)) from e
+    click.echo(f"Imported {result.entries:n} entries ({result.size:n} bytes), already cached {len(result.skipped):n}")
+
+
+@click.command("prefetch")
+@click.argument("providers", nargs=-1)
+@click.option("-b", "--bookmarks", is_flag=True, help="Prefetch bookmarked providers")
+@click.option("-t", "--top", type=int, default=0, help="Prefetch N most popular providers")
+@click.option(
+    "-v",
+    "--versions",
+    type=int,
+    default=1,
+    show_default=True,
+    help="How many most recent versions to prefetch (unless pinned with 'organization/name@version')",
+)
+@click.option("-c", "--concurrency", type=int, default=8, show_default=True, help="Maximum concurrent downloads")
+def prefetch_cmd(providers: tuple[str, ...], bookmarks: bool, top: int, versions: int, concurrency: int) -> None:
+    """
+    Downloads all documents of PROVIDERS ('organization/name' or 'organization/name@version') into the cache.
+
+    Already cached documents are skipped, so it's safe to run again after an interruption.
+    """
+    if not (providers or bookmarks or top):
+        raise click.UsageError("Nothing to prefetch, pass PROVIDERS, --bookmarks or --top")
+
+    async def run() -> PrefetchResult:
+        try:
+            targets = await resolve_targets(providers, bookmarks=bookmarks, top=top, versions=versions)
+            for target in targets:
+                click.echo(f"{target.provider.display_name}: {', '.join(target.versions)}")
+            with click.progressbar(length=0, label="Documents", show_pos=True) as bar:
+
+                def on_progress(done: int, total: int) -> None:
+                    bar.length = total
+                    bar.update(done - bar.pos)
+
+                return await prefetch(targets, concurrency=concurrency, on_progress=on_progress)
+        finally:
+            await close_http_client()
+            await flush_metadata()
+            close_cache()
+
+    try:
+        result = asyncio.run(run())
+    except PrefetchError as e:
+        raise click.ClickException(str(e)) from e
+    click.echo(f"Downloaded {result.downloaded:n}, already cached {result.skipped:n}, failed {len(result.failed):n}")
+    for failed in result.failed:
+        click.echo(f"  failed: {failed}", err=True)
+    if result.failed:
+        sys.exit(1)
 
 
 def main() -> None:
-    @click.command()
+    @click.group(invoke_without_command=True)
     @click.option("-p", "--provider", help="Provider to open on startup (e.g., 'integrations/github')")
     @click.option(
         "-r",
@@ -440,11 +689,16 @@ def main() -> None:
         help="Data source to open on startup. Use 'provider_data' format (e.g., 'github_actions_environment_secrets') "
         "to auto-resolve provider, or just 'data_source_name' with --provider",
     )
-    def cli(provider: str | None, resource: str | None, data: str | None) -> None:
+    @click.pass_context
+    def cli(ctx: click.Context, provider: str | None, resource: str | None, data: str | None) -> None:
+        if ctx.invoked_subcommand is not None:
+            return
         target = StartupTarget(provider=provider, resource=resource, data=data)
         LOGGER.debug("Starting tofuref with %s", target)
         TofuRefApp(startup=target).run()
 
+    cli.add_command(prefetch_cmd)
+    cli.add_command(cache_cmd)
     cli()
 
 
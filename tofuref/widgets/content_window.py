@@ -116,12 +116,21 @@ Tip: Use `b` to bookmark frequently used items and prioritize them in future sor
 * GitHub: https://github.com/djetelina/tofuref"""
 
         self.content = content if content is not None else welcome_content
+        # Beginning of a document that's still downloading, the document is appended to it
+        self._preview: str | None = None
         super().__init__(
             self.content,
             show_table_of_contents=False,
             **kwargs,
         )
 
+    async def preview(self, markdown: str) -> None:
+        """Renders the beginning of a document while it's downloading, `update` with the whole document follows"""
+        self._preview = preview_markdown(sanitize_markdown(markdown).strip())
+        self.content = self._preview
+        self.loading = False
+        await self.document.update(self.content)
+
     async def update(self, markdown: str) -> None:
         markdown = sanitize_markdown(markdown).strip()
 
@@ -139,8 +148,13 @@ Tip: Use `b` to bookmark frequently used items and prioritize them in future sor
             """
             markdown = f"{incomplete_infobox}\n\n{markdown_stripped}"
 
+        preview, self._preview = self._preview, None
         self.content = markdown
-        await self.document.update(self.content)
+        if preview and markdown.startswith(preview):
+            # Only the rest of the document needs to be parsed and mounted
+            await self.document.append(markdown[len(preview) :])
+        else:
+            await self.document.update(self.content)
 
     def action_toggle_toc(self):
         self.show_table_of_contents = not self.show_table_of_contents
@@ -190,6 +204,23 @@ def sanitize_markdown(markdown: str) -> str:
     return re.sub(r"<.*?>", "", markdown)
 
 
+def preview_markdown(markdown: str) -> str:
+    r"""
+    Beginning of a document cut after its last complete paragraph, so that a half received code block
+    doesn't turn the rest of the preview into code.
+
+    >>> preview_markdown("# Title\n\nSome text\n\n```hcl\nresource")
+    '# Title\n\nSome text\n\n'
+    """
+    cut = markdown.rfind("\n\n")
+    if cut == -1:
+        return markdown
+    markdown = markdown[: cut + 2]
+    if markdown.count("```") % 2:
+        markdown = markdown[: markdown.rfind("```")]
+    return markdown
+
+
 def remove_sections_for_nested(markdown: str, min_dots: int) -> str:
     flags = re.M | re.I
     dot_lookahead = rf"(?=(?:[^.\n]*\.){{{min_dots},}})"
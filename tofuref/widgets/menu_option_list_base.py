@@ -1,8 +1,11 @@
 from typing import ClassVar
 
 from textual.binding import BindingType
+from textual.timer import Timer
 from textual.widgets import OptionList
+from textual.widgets.option_list import Option
 
+from tofuref.config import config
 from tofuref.data.meta import Item
 from tofuref.widgets.keybindings import BOOKMARK, CLEAR_CACHE, VIM_OPTION_LIST_NAVIGATE
 
@@ -25,6 +28,10 @@ class MenuOptionListBase(OptionList):
     }
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._dwell_timer: Timer | None = None
+
     async def action_bookmark(self):
         if self.highlighted is None:
             return
@@ -40,17 +47,46 @@ class MenuOptionListBase(OptionList):
             self.replace_option_prompt_at_index(self.highlighted, self.highlighted_option.prompt)
             self.app.notify(f"{res.__class__.__name__} {res.display_name} removed from bookmarks", title="Bookmark removed")
 
+    def refresh_option(self, option: Option) -> None:
+        """Renders the prompt of an option again (its item changed), wherever it is in the list by now"""
+        try:
+            index = self.options.index(option)
+        except ValueError:
+            # Not listed anymore (search changed the options)
+            return
+        self.replace_option_prompt_at_index(index, option.prompt)
+
     async def action_purge_from_cache(self):
         if self.highlighted is None:
             return
         res: Item = self.highlighted_option.prompt
-        await res.clear_from_cache()
+        await res.clear_from_cache(self.app.bookmarks)
         self.replace_option_prompt_at_index(self.highlighted, self.highlighted_option.prompt)
         self.app.notify(f"{res.__class__.__name__} {res.display_name} purged from cache", title="Cache purged")
 
     def watch_highlighted(self, highlighted: int | None) -> None:
         super().watch_highlighted(highlighted)
         self.refresh_bindings()
+        self.schedule_speculative_prefetch()
+
+    def schedule_speculative_prefetch(self) -> None:
+        """
+        Users almost always select what they just highlighted, so when the highlight rests on an item
+        for `prefetch_dwell` seconds, we start fetching it in the background. Moving on cancels it.
+        """
+        if self._dwell_timer is not None:
+            self._dwell_timer.stop()
+            self._dwell_timer = None
+        self.workers.cancel_group(self, "speculative-prefetch")
+        if config.prefetch_dwell > 0 and self.highlighted_option is not None:
+            self._dwell_timer = self.set_timer(config.prefetch_dwell, self._start_speculative_prefetch)
+
+    def _start_speculative_prefetch(self) -> None:
+        self._dwell_timer = None
+        if self.highlighted_option is None:
+            return
+        item: Item = self.highlighted_option.prompt
+        self.run_worker(item.prefetch(), name=f"prefetch {item.display_name}", group="speculative-prefetch", exit_on_error=False)
 
     def check_action(self, action: str, parameters: tuple[object, ...]) -> bool:
         return not (action == "purge_from_cache" and self.highlighted_option and not self.highlighted_option.prompt.cached)
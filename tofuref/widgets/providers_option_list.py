@@ -1,7 +1,7 @@
 import json
 import logging
 import time
-from collections.abc import Collection
+from collections.abc import Collection, Iterable
 from pathlib import Path
 from typing import ClassVar, cast
 
@@ -9,9 +9,12 @@ from textual.binding import BindingType
 from textual.widgets.option_list import Option
 
 from tofuref.config import config
-from tofuref.data.cache import get_cached_providers
+from tofuref.data.cache import get_cached_providers, get_from_cache, is_cached, load_validators
+from tofuref.data.connectivity import connectivity
+from tofuref.data.decoding import ProviderIndex, decode_json
 from tofuref.data.helpers import get_registry_api
-from tofuref.data.providers import Provider
+from tofuref.data.providers import Provider, listed_providers
+from tofuref.data.snapshot import load_provider_snapshot, save_provider_snapshot
 from tofuref.widgets import keybindings
 from tofuref.widgets.menu_option_list_base import MenuOptionListBase
 
@@ -30,6 +33,7 @@ class ProvidersOptionList(MenuOptionListBase):
         )
         self.display = False
         self.fallback_providers_file = Path(__file__).resolve().parent.parent / "fallback" / "providers.json"
+        self.index_expired = False
 
     def populate(
         self,
@@ -42,12 +46,31 @@ class ProvidersOptionList(MenuOptionListBase):
         self.border_subtitle = f"{len(providers):n} / {len(self.app.providers):n}"
 
     async def load_index(self) -> dict[str, Provider]:
+        """
+        Cached index is always used right away, even when expired, so the first screen never waits for the registry.
+        Expired index gets refreshed in the background afterward (see `refresh_index`).
+        """
         LOGGER.debug("Loading providers")
 
-        data = await get_registry_api("index.json")
+        if await is_cached("index.json"):
+            if (snapshot := await load_provider_snapshot()) is not None:
+                LOGGER.debug("Using provider snapshot")
+                providers = sort_providers(await self.load_providers(snapshot))
+                await self.app.force_draw(initial=True)
+                return providers
+            data = await get_registry_api("index.json")
+        elif stale_index := await get_from_cache("index.json", allow_expired=True):
+            LOGGER.info("Provider index expired, using it until it's refreshed in the background")
+            data = decode_json(stale_index, ProviderIndex)
+            self.index_expired = True
+        else:
+            # Don't make the first screen wait for a full timeout when we are offline
+            await connectivity.probe()
+            data = await get_registry_api("index.json")
         await self.app.force_draw(initial=True)
-        if not data:
-            data = json.loads(self.fallback_providers_file.read_text())
+        fallback = not data
+        if fallback:
+            data = decode_json(self.fallback_providers_file.read_bytes(), ProviderIndex)
             self.app.notify(
                 "Something went wrong while fetching index of providers, using limited fallback.",
                 title="Using fallback",
@@ -57,39 +80,70 @@ class ProvidersOptionList(MenuOptionListBase):
         LOGGER.debug("Got API response (or fallback)")
         await self.app.force_draw(initial=True)
 
-        providers = await self.load_providers(data)
-
-        providers = dict(sorted(providers.items(), key=lambda p: (p[1].bookmarked, p[1].cached, p[1].popularity), reverse=True))
+        listed = listed_providers(data)
+        if not self.index_expired and not fallback:
+            await save_provider_snapshot(listed)
+        providers = sort_providers(await self.load_providers(listed))
         await self.app.force_draw(initial=True)
         return providers
 
-    async def load_providers(self, data: dict) -> dict[str, Provider]:
+    async def refresh_index(self) -> None:
         """
-        Loads providers from API data. To show up in tofuref, it must:
-
-        * have version
-        * not be blocked in the registry
-        * not be a fork
-        * not be part of the organizations opentofu or terraform-providers, because those are just duplicates
+        Revalidates expired index and merges new or changed providers into the already displayed ones.
+        Existing Provider objects are updated in place, so the active provider and the highlight stay as they are.
         """
-        providers = {}
-        cached_providers = await get_cached_providers()
+        etag = (await load_validators("index.json")).get("etag")
+        data = await get_registry_api("index.json")
+        if not data:
+            LOGGER.info("Provider index couldn't be refreshed, keeping the expired one")
+            return
+        self.index_expired = False
+        listed = listed_providers(data)
+        # Revalidated index has a new identity even when not modified
+        await save_provider_snapshot(listed)
+        if etag is not None and etag == (await load_validators("index.json")).get("etag"):
+            LOGGER.info("Provider index not modified")
+            return
 
-        for provider_json in data["providers"]:
-            provider = Provider.from_json(provider_json)
+        refreshed = await self.load_providers(listed)
+        new_providers = 0
+        for display_name, provider in refreshed.items():
+            if display_name in self.app.providers:
+                self.app.providers[display_name].update_from(provider)
+            else:
+                self.app.providers[display_name] = provider
+                new_providers += 1
+        # Removed, blocked or marked as a fork since
+        delisted = {display_name for display_name in self.app.providers if display_name not in refreshed}
+        for display_name in delisted:
+            del self.app.providers[display_name]
+        self.app.providers = sort_providers(self.app.providers)
+        LOGGER.info(f"Provider index refreshed, {new_providers} new providers, {len(delisted)} delisted")
+
+        # Search results are left alone except for delisted providers, new ones show up with the next search
+        if self.app.search.has_parent and self.app.search.value:
+            for index in reversed(range(self.option_count)):
+                if cast(Provider, self.get_option_at_index(index).prompt).display_name in delisted:
+                    self.remove_option_at_index(index)
+            return
+        highlighted = self.highlighted_option.prompt if self.highlighted_option is not None else None
+        self.populate()
+        if highlighted is not None and cast(Provider, highlighted).display_name in self.app.providers:
+            self.highlighted = list(self.app.providers.values()).index(highlighted)
 
-            filter_in = (
-                provider.versions,
-                not provider.blocked,
-                not provider.fork_of,
-                provider.organization not in ["terraform-providers", "opentofu"],
-            )
-            if all(filter_in):
-                providers[provider.display_name] = provider
-                if self.app.bookmarks.check("providers", provider.identifying_name):
-                    provider.bookmarked = True
-                if provider.display_name in cached_providers:
-                    provider.cached = True
+    async def load_providers(self, listed: Iterable[Provider]) -> dict[str, Provider]:
+        """
+        Marks bookmarked and cached providers, from those that should be listed (see `listed_providers`).
+        """
+        providers = {}
+        cached_providers = set(await get_cached_providers())
+
+        for provider in listed:
+            providers[provider.display_name] = provider
+            if self.app.bookmarks.check("providers", provider.identifying_name):
+                provider.bookmarked = True
+            if provider.display_name in cached_providers:
+                provider.cached = True
         return providers
 
     async def on_option_selected(self, option: Option) -> None:
@@ -104,7 +158,7 @@ class ProvidersOptionList(MenuOptionListBase):
         self.app.navigation_resources.focus()
 
         await self.app.force_draw()
-        self.replace_option_prompt_at_index(self.highlighted, option.prompt)
+        self.refresh_option(option)
 
         if config.show_load_times:
             __load_time = time.perf_counter() - __start_time
@@ -138,3 +192,7 @@ class ProvidersOptionList(MenuOptionListBase):
                 title="GitHub stats error",
                 severity="error",
             )
+
+
+def sort_providers(providers: dict[str, Provider]) -> dict[str, Provider]:
+    return dict(sorted(providers.items(), key=lambda p: (p[1].bookmarked, p[1].cached, p[1].popularity), reverse=True))
@@ -1,14 +1,20 @@
 import asyncio
+import logging
 from typing import ClassVar, cast
 
 from textual.binding import BindingType
 from textual.widgets.option_list import Option
 
-from tofuref.data.providers import Provider
+from tofuref.data.providers import Provider, diff_resources
 from tofuref.data.resources import Resource
 from tofuref.widgets.keybindings import BACK, LEFT_BACK
 from tofuref.widgets.menu_option_list_base import MenuOptionListBase
 
+LOGGER = logging.getLogger(__name__)
+
+# How many added and removed resources are named in the summary after switching versions
+VERSION_DIFF_LISTED = 5
+
 
 class ResourcesOptionList(MenuOptionListBase):
     BINDINGS: ClassVar[list[BindingType]] = [*MenuOptionListBase.BINDINGS, BACK, LEFT_BACK]
@@ -21,6 +27,8 @@ class ResourcesOptionList(MenuOptionListBase):
             **kwargs,
         )
         self.display = False
+        # How prompts of the options looked when they were rendered (bookmarked, cached, title)
+        self._rendered: dict[Option, tuple[bool, bool, str]] = {}
 
     def populate(
         self,
@@ -28,13 +36,29 @@ class ResourcesOptionList(MenuOptionListBase):
         resources: list[Resource] | None = None,
     ) -> None:
         self.clear_options()
+        self._rendered = {}
         if provider is None:
             return
 
-        if resources is None:
-            self.add_options(provider.resources + provider.datasources)
-        else:
-            self.add_options(resources)
+        self.add_options(provider.resources if resources is None else resources)
+        self._rendered = {option: self._look(cast(Resource, option.prompt)) for option in self.options}
+
+    @staticmethod
+    def _look(resource: Resource) -> tuple[bool, bool, str]:
+        return resource.bookmarked, resource.cached, resource.display_name
+
+    def update_resources(self, resources: list[Resource]) -> None:
+        """
+        Replaces listed resources, keeping the options (with their already rendered prompts)
+        of resources that stay in the list and look the same.
+        """
+        reusable = {
+            id(option.prompt): option for option in self.options if self._rendered.get(option) == self._look(cast(Resource, option.prompt))
+        }
+        options = [reusable.get(id(resource)) or Option(resource) for resource in resources]
+        self._rendered = {option: self._look(cast(Resource, option.prompt)) for option in options}
+        LOGGER.debug(f"Rendering {len(options) - len(reusable.keys() & {id(r) for r in resources})} of {len(options)} resource options")
+        self.set_options(options)
 
     async def load_provider_resources(
         self,
@@ -42,20 +66,46 @@ class ResourcesOptionList(MenuOptionListBase):
     ):
         self.loading = True
         self.app.content_markdown.loading = True
-        # Let the loading paint
-        await self.app.force_draw()
-        loaders = [self.render_overview(provider), provider.load_resources(bookmarks=self.app.bookmarks)]
-        await asyncio.gather(*loaders)
-        # Let the content update behind the loading screen
-        await self.app.force_draw()
-        self.app.content_markdown.loading = False
-        self.populate(provider)
+        try:
+            # Let the loading paint
+            await self.app.force_draw()
+            loaders = [self.render_overview(provider), provider.load_resources(bookmarks=self.app.bookmarks)]
+            await asyncio.gather(*loaders)
+            # Let the content update behind the loading screen
+            await self.app.force_draw()
+            self.populate(provider)
+            self.focus()
+            self.highlighted = 0
+        finally:
+            # Also when superseded by another selection, which shows its own loading
+            self.app.content_markdown.loading = False
+            self.loading = False
+
+    async def load_provider_version(self, provider: Provider, previous: list[Resource], previous_version: str) -> None:
+        """Active version of the provider changed, only resources added or removed (or changed looks) are rendered again"""
+        self.app.content_markdown.loading = True
+        try:
+            await asyncio.gather(self.render_overview(provider), provider.load_resources(bookmarks=self.app.bookmarks, reuse=previous))
+        finally:
+            self.app.content_markdown.loading = False
+        self.update_resources(provider.resources)
         self.focus()
         self.highlighted = 0
-        self.loading = False
+        added, removed = diff_resources(previous, provider.resources)
+        if previous and (added or removed):
+            self.notify(
+                "\n".join(
+                    [
+                        *(f"+ {r.display_name}" for r in added[:VERSION_DIFF_LISTED]),
+                        *(f"- {r.display_name}" for r in removed[:VERSION_DIFF_LISTED]),
+                    ]
+                ),
+                title=f"{len(added)} added, {len(removed)} removed since {previous_version}",
+                markup=False,
+            )
 
     async def render_overview(self, provider):
-        overview = await provider.overview()
+        overview = await provider.overview(on_preview=self.app.content_markdown.preview)
         await self.app.content_markdown.update(overview)
         await self.app.force_draw()
 
@@ -65,13 +115,14 @@ class ResourcesOptionList(MenuOptionListBase):
         self.app.content_markdown.loading = True
         was_cached = resource_selected.cached
 
-        content = await resource_selected.content()
-        await self.app.content_markdown.update(content)
-        is_cached = resource_selected.cached
-        if was_cached != is_cached:
-            self.replace_option_prompt_at_index(self.highlighted, option.prompt)
+        try:
+            content = await resource_selected.content(on_preview=self.app.content_markdown.preview)
+            await self.app.content_markdown.update(content)
+        finally:
+            self.app.content_markdown.loading = False
+        if was_cached != resource_selected.cached:
+            self.refresh_option(option)
         self.app.content_markdown.document.focus()
-        self.app.content_markdown.loading = False
 
     def action_back(self):
         self.app.action_providers()
@@ -54,6 +54,12 @@ class Status(Container):
     #header-links Link {
         padding: 0 1;
     }
+
+    #header-offline {
+        padding: 0 1;
+        color: $warning;
+        text-style: bold;
+    }
     """
 
     def __init__(self, *args, **kwargs) -> None:
@@ -62,6 +68,8 @@ class Status(Container):
         self.version = StatusText("-")
         self.resource = StatusText("Welcome")
         self._path_label = Label("")
+        self.offline = Label("Offline", id="header-offline")
+        self.offline.display = False
 
     def compose(self) -> ComposeResult:
         with Container(id="header-status"):
@@ -72,5 +80,9 @@ class Status(Container):
                 yield Label(" ⇢ ")
                 yield self.resource
             with Container(id="header-links"):
+                yield self.offline
                 yield Link("GitHub", url="https://github.com/djetelina/tofuref")
                 yield Link("Changelog", url="https://github.com/djetelina/tofuref/blob/main/CHANGELOG.md")
+
+    def set_offline(self, offline: bool) -> None:
+        self.offline.display = offline